@@ -0,0 +1,408 @@
+# backup.py
+"""Online backups and point-in-time restores of the expense databases.
+
+    python backup.py snapshot                      # full copy of every database
+    python backup.py incremental                   # changes since the last backup
+    python backup.py list
+    python backup.py restore --output restored/    # latest state, into a new directory
+    python backup.py restore --at "2025-06-01 12:00:00" --in-place
+
+Full snapshots use the SQLite backup API a few pages at a time and pause
+between steps, so the MCP server's writers get the database between steps
+instead of waiting for the whole copy. Incrementals are small SQLite files
+with the expenses changed since the previous backup (by updated_at), the ids
+deleted since then (from the expense_deletions log filled by a trigger), and
+the small users and shard_assignments tables in full. The jobs table is only
+captured by full snapshots.
+
+The main database and every shard have their own chain of backups under
+EXPENSE_BACKUP_DIR/<database>/, listed in a manifest.json. A restore copies
+the newest full snapshot taken at or before the requested time (UTC, as
+stored by SQLite) and replays the incrementals after it up to that time.
+"""
+import json
+import os
+import shutil
+import sqlite3
+import time
+
+import db_utils
+from utils.metrics import describe, get_logger, observe
+
+logger = get_logger(__name__)
+
+BACKUP_DIR = os.getenv("EXPENSE_BACKUP_DIR", "backups")
+# Pages copied per backup step (4 MiB with the default page size) and the
+# pause between steps that lets writers in
+BACKUP_PAGES = int(os.getenv("EXPENSE_BACKUP_PAGES", "1024"))
+BACKUP_PAUSE = float(os.getenv("EXPENSE_BACKUP_PAUSE", "0.005"))
+# A write from another connection restarts a snapshot. After this many
+# restarts the step size is no longer limited, so the copy always finishes.
+MAX_RESTARTS = 5
+# Seconds before the previous backup that an incremental captures again, so
+# a transaction that stamped updated_at before that backup but committed
+# after it is not missed. Replaying a row twice is harmless.
+CAPTURE_OVERLAP = int(os.getenv("EXPENSE_BACKUP_OVERLAP", "300"))
+# Small tables copied whole into every incremental, when the database has them
+WHOLE_TABLES = ("users", "shard_assignments")
+
+describe("backup_duration_seconds", "Duration of snapshots, incrementals and restores.")
+
+
+class _Restarted(Exception):
+    """The source changed under a paged copy, which SQLite then restarts."""
+
+
+def _databases():
+    """Yield (label, path) for the main database and every existing shard."""
+    yield "main", db_utils.DB_PATH
+    for i in range(db_utils.SHARD_COUNT):
+        if os.path.exists(db_utils.shard_path(i)):
+            db_utils.get_shard_conn(i)  # creates the deletion log on shards from before it existed
+            yield f"shard{i}", db_utils.shard_path(i)
+
+
+def _live_path(label):
+    if label == "main":
+        return db_utils.DB_PATH
+    return db_utils.shard_path(int(label[len("shard"):]))
+
+
+def _manifest_path(backup_dir, label):
+    return os.path.join(backup_dir, label, "manifest.json")
+
+
+def _load_manifest(backup_dir, label):
+    path = _manifest_path(backup_dir, label)
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_manifest(backup_dir, label, entries):
+    path = _manifest_path(backup_dir, label)
+    with open(path + ".tmp", "w") as f:
+        json.dump(entries, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def _now(db):
+    """Current time in SQLite's DATETIME('now') format, comparable with updated_at."""
+    return db.execute("SELECT DATETIME('now')").fetchone()[0]
+
+
+def _backup_file(backup_dir, label, entries, kind, taken_at):
+    stamp = taken_at.replace("-", "").replace(":", "").replace(" ", "T")
+    return os.path.join(backup_dir, label, f"{len(entries):05d}-{kind}-{stamp}.db")
+
+
+def _columns(db, schema, table):
+    return ", ".join(row[1] for row in db.execute(f"PRAGMA {schema}.table_info({table})"))
+
+
+def copy_database(src, dest, pages=BACKUP_PAGES, pause=BACKUP_PAUSE, max_restarts=MAX_RESTARTS):
+    """Copy the src connection's database into dest with the backup API.
+
+    The source is only read-locked during each step of `pages` pages. Every
+    restart (another connection wrote to the source) doubles the step size,
+    and after max_restarts the rest is copied in one step, which in WAL mode
+    (see init_db) still does not block writers. Returns
+    {"steps", "restarts", "pages"}.
+    """
+    stats = {"steps": 0, "restarts": 0, "pages": 0}
+    last = None
+
+    def progress(status, remaining, total):
+        nonlocal last
+        if status in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED):
+            return  # SQLite waits and retries the same step
+        stats["steps"] += 1
+        stats["pages"] = total
+        if last is not None and remaining >= last:
+            raise _Restarted()
+        last = remaining
+        if remaining and pause:
+            time.sleep(pause)
+
+    step = pages
+    while True:
+        last = None
+        try:
+            src.backup(dest, pages=step, progress=progress)
+            return stats
+        except _Restarted:
+            stats["restarts"] += 1
+            step = -1 if stats["restarts"] >= max_restarts or step <= 0 else step * 2
+            logger.info("source changed during backup, restarting (step %s pages)", step)
+
+
+def _snapshot_one(backup_dir, label, path, pages, pause):
+    entries = _load_manifest(backup_dir, label)
+    start = time.perf_counter()
+    src = sqlite3.connect(path, timeout=30)
+    try:
+        part = os.path.join(backup_dir, label, "snapshot.part")
+        dest = sqlite3.connect(part)
+        try:
+            stats = copy_database(src, dest, pages, pause)
+        finally:
+            dest.close()
+        taken_at = _now(src)
+    finally:
+        src.close()
+
+    file = _backup_file(backup_dir, label, entries, "full", taken_at)
+    os.replace(part, file)
+    seconds = time.perf_counter() - start
+    observe("backup_duration_seconds", seconds, kind="full")
+    entry = {"kind": "full", "file": os.path.basename(file), "taken_at": taken_at,
+             "bytes": os.path.getsize(file), "seconds": round(seconds, 3), **stats}
+    _save_manifest(backup_dir, label, entries + [entry])
+    logger.info("full backup of %s: %s bytes in %.2fs", label, entry["bytes"], seconds)
+    return {"database": label, **entry}
+
+
+def snapshot(backup_dir=BACKUP_DIR, pages=BACKUP_PAGES, pause=BACKUP_PAUSE, prune_log=False):
+    """Take a full online backup of the main database and every shard.
+
+    With prune_log, deletion log entries the new snapshot already covers are
+    removed; only use it when no other backup chain relies on the log.
+    """
+    taken = []
+    for label, path in _databases():
+        os.makedirs(os.path.join(backup_dir, label), exist_ok=True)
+        taken.append(_snapshot_one(backup_dir, label, path, pages, pause))
+        if prune_log:
+            with sqlite3.connect(path, timeout=30) as db:
+                db.execute("DELETE FROM expense_deletions WHERE deleted_at < DATETIME(?, ?)",
+                           (taken[-1]["taken_at"], f"-{CAPTURE_OVERLAP} seconds"))
+
+    total = sum(entry["bytes"] for entry in taken)
+    return {"ok": True, "backups": taken,
+            "message": f"Backed up {len(taken)} database(s), {total} bytes"}
+
+
+def _capture(src, path, since):
+    """Write the changes of src since `since` into a new SQLite file at path; return counts."""
+    src.execute("ATTACH DATABASE ? AS inc", (path,))
+    try:
+        src.execute("BEGIN")
+        taken_at = _now(src)
+        window = (since, f"-{CAPTURE_OVERLAP} seconds")
+        src.execute("CREATE TABLE inc.expenses AS SELECT * FROM main.expenses "
+                    "WHERE updated_at >= DATETIME(?, ?)", window)
+        # Skip ids that exist again (moved back onto this shard) since their row is captured above
+        src.execute("CREATE TABLE inc.deletions AS SELECT expense_id, user_id, deleted_at "
+                    "FROM main.expense_deletions d WHERE deleted_at >= DATETIME(?, ?) "
+                    "AND NOT EXISTS (SELECT 1 FROM main.expenses e WHERE e.id = d.expense_id)", window)
+        src.execute("CREATE TABLE inc.sequence AS SELECT name, seq FROM main.sqlite_sequence")
+        existing = {row[0] for row in src.execute("SELECT name FROM main.sqlite_master WHERE type = 'table'")}
+        for table in WHOLE_TABLES:
+            if table in existing:
+                src.execute(f"CREATE TABLE inc.{table} AS SELECT * FROM main.{table}")
+        changed = src.execute("SELECT COUNT(*) FROM inc.expenses").fetchone()[0]
+        deleted = src.execute("SELECT COUNT(*) FROM inc.deletions").fetchone()[0]
+        src.execute("COMMIT")
+    except BaseException:
+        src.execute("ROLLBACK")
+        raise
+    finally:
+        src.execute("DETACH DATABASE inc")
+    return taken_at, changed, deleted
+
+
+def incremental(backup_dir=BACKUP_DIR):
+    """Capture the changes since the last backup of every database.
+
+    A database without a full snapshot yet gets one instead.
+    """
+    taken = []
+    for label, path in _databases():
+        entries = _load_manifest(backup_dir, label)
+        if not any(entry["kind"] == "full" for entry in entries):
+            os.makedirs(os.path.join(backup_dir, label), exist_ok=True)
+            taken.append(_snapshot_one(backup_dir, label, path, BACKUP_PAGES, BACKUP_PAUSE))
+            continue
+
+        start = time.perf_counter()
+        part = os.path.join(backup_dir, label, "incremental.part")
+        if os.path.exists(part):
+            os.remove(part)
+        src = sqlite3.connect(path, timeout=30, isolation_level=None)
+        try:
+            taken_at, changed, deleted = _capture(src, part, entries[-1]["taken_at"])
+        finally:
+            src.close()
+
+        file = _backup_file(backup_dir, label, entries, "incremental", taken_at)
+        os.replace(part, file)
+        seconds = time.perf_counter() - start
+        observe("backup_duration_seconds", seconds, kind="incremental")
+        entry = {"kind": "incremental", "file": os.path.basename(file), "taken_at": taken_at,
+                 "since": entries[-1]["taken_at"], "changed": changed, "deleted": deleted,
+                 "bytes": os.path.getsize(file), "seconds": round(seconds, 3)}
+        _save_manifest(backup_dir, label, entries + [entry])
+        logger.info("incremental backup of %s: %s changed, %s deleted", label, changed, deleted)
+        taken.append({"database": label, **entry})
+
+    return {"ok": True, "backups": taken, "message": f"Backed up {len(taken)} database(s)"}
+
+
+def list_backups(backup_dir=BACKUP_DIR):
+    """Return the backup chain of every database in backup_dir."""
+    if not os.path.isdir(backup_dir):
+        return {"ok": True, "databases": {}, "message": "No backups yet."}
+    databases = {
+        label: _load_manifest(backup_dir, label)
+        for label in sorted(os.listdir(backup_dir))
+        if os.path.exists(_manifest_path(backup_dir, label))
+    }
+    count = sum(len(entries) for entries in databases.values())
+    return {"ok": True, "databases": databases, "message": f"{count} backup(s) of {len(databases)} database(s)"}
+
+
+def _apply_incremental(db, path):
+    """Replay an incremental file onto the restored database."""
+    db.execute("ATTACH DATABASE ? AS inc", (path,))
+    try:
+        db.execute("BEGIN")
+        columns = _columns(db, "inc", "expenses")
+        db.execute(f"INSERT OR REPLACE INTO main.expenses ({columns}) SELECT {columns} FROM inc.expenses ORDER BY id")
+
+        # Delete, then put back the original log entries instead of the ones the trigger adds now
+        mark = db.execute("SELECT COALESCE(MAX(rowid), 0) FROM main.expense_deletions").fetchone()[0]
+        db.execute("DELETE FROM main.expenses WHERE id IN (SELECT expense_id FROM inc.deletions)")
+        db.execute("DELETE FROM main.expense_deletions WHERE rowid > ?", (mark,))
+        db.execute("""
+            INSERT INTO main.expense_deletions (expense_id, user_id, deleted_at)
+            SELECT expense_id, user_id, deleted_at FROM inc.deletions d
+            WHERE NOT EXISTS (SELECT 1 FROM main.expense_deletions l
+                              WHERE l.deleted_at = d.deleted_at AND l.expense_id = d.expense_id)
+        """)
+
+        # Rows moved in from another shard can carry ids above this shard's range, and
+        # re-inserting them bumps the sequence; put back the exact captured value
+        db.execute("""
+            UPDATE main.sqlite_sequence
+            SET seq = (SELECT s.seq FROM inc.sequence s WHERE s.name = sqlite_sequence.name)
+            WHERE name IN (SELECT name FROM inc.sequence)
+        """)
+        captured = {row[0] for row in db.execute("SELECT name FROM inc.sqlite_master WHERE type = 'table'")}
+        for table in WHOLE_TABLES:
+            if table in captured:
+                columns = _columns(db, "inc", table)
+                db.execute(f"DELETE FROM main.{table}")
+                db.execute(f"INSERT INTO main.{table} ({columns}) SELECT {columns} FROM inc.{table}")
+        db.execute("COMMIT")
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+    finally:
+        db.execute("DETACH DATABASE inc")
+
+
+def restore(at=None, backup_dir=BACKUP_DIR, output=None, in_place=False):
+    """Restore every backed-up database as of `at` (default: the latest backup).
+
+    `at` is a UTC time such as "2025-06-01 12:00:00"; each database comes back
+    as of its newest backup taken at or before it. A shard whose first backup
+    is later than `at` did not exist yet, so it comes back empty. Restored
+    files are written under `output` with the live layout, or with in_place
+    copied into the live databases through the backup API (stop the MCP
+    server first, or its writes since the backup are lost).
+    """
+    if not output and not in_place:
+        return {"ok": False, "message": "Give an output directory or restore in place."}
+    at = at.replace("T", " ") if at else None
+    databases = list_backups(backup_dir)["databases"]
+    if not databases:
+        return {"ok": False, "message": f"No backups found in {backup_dir}."}
+
+    plans = {}
+    for label, entries in databases.items():
+        usable = [entry for entry in entries if at is None or entry["taken_at"] <= at]
+        fulls = [i for i, entry in enumerate(usable) if entry["kind"] == "full"]
+        if fulls:
+            plans[label] = usable[fulls[-1]:]
+        elif label != "main":
+            plans[label] = []  # shard created after `at`
+        else:
+            return {"ok": False, "message": f"No full backup of {label} at or before {at}."}
+
+    restored = []
+    for label, chain in plans.items():
+        start = time.perf_counter()
+        live = _live_path(label)
+        if in_place:
+            target = live + ".restore"
+        else:
+            subdir = "" if label == "main" else os.path.basename(db_utils.SHARD_DIR)
+            target = os.path.join(output, subdir, os.path.basename(live))
+        os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+
+        if chain:
+            shutil.copyfile(os.path.join(backup_dir, label, chain[0]["file"]), target)
+        else:
+            for path in (target, target + "-wal", target + "-shm"):
+                if os.path.exists(path):
+                    os.remove(path)
+            db_utils.init_shard(target, int(label[len("shard"):])).close()
+        db = sqlite3.connect(target, isolation_level=None)
+        try:
+            # Nothing uses the file until the restore is done; a crash means running it again
+            db.execute("PRAGMA synchronous = OFF")
+            for entry in chain[1:]:
+                _apply_incremental(db, os.path.join(backup_dir, label, entry["file"]))
+            db.execute("PRAGMA synchronous = FULL")  # so the checkpoint on close is synced
+            if in_place:
+                os.makedirs(os.path.dirname(os.path.abspath(live)), exist_ok=True)
+                live_db = sqlite3.connect(live, timeout=30)
+                try:
+                    db.backup(live_db)
+                finally:
+                    live_db.close()
+        finally:
+            db.close()
+        if in_place:
+            os.remove(target)
+
+        seconds = time.perf_counter() - start
+        observe("backup_duration_seconds", seconds, kind="restore")
+        as_of = chain[-1]["taken_at"] if chain else None
+        logger.info("restored %s as of %s in %.2fs", label, as_of or "before its first backup (empty)", seconds)
+        restored.append({"database": label, "as_of": as_of, "incrementals": max(len(chain) - 1, 0),
+                         "path": live if in_place else target, "seconds": round(seconds, 3)})
+
+    return {"ok": True, "restored": restored,
+            "message": f"Restored {len(restored)} database(s) as of {at or 'the latest backup'}"}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Back up and restore the expense databases")
+    parser.add_argument("--dir", default=BACKUP_DIR, help="backup directory")
+    sub = parser.add_subparsers(dest="command", required=True)
+    snap = sub.add_parser("snapshot", help="full online backup")
+    snap.add_argument("--pages", type=int, default=BACKUP_PAGES, help="pages copied per step")
+    snap.add_argument("--pause", type=float, default=BACKUP_PAUSE, help="seconds between steps")
+    snap.add_argument("--prune-log", action="store_true", help="drop deletion log entries the snapshot covers")
+    sub.add_parser("incremental", help="capture changes since the last backup")
+    sub.add_parser("list", help="list backups")
+    rest = sub.add_parser("restore", help="point-in-time restore")
+    rest.add_argument("--at", help="UTC time, e.g. '2025-06-01 12:00:00' (default: latest)")
+    target = rest.add_mutually_exclusive_group(required=True)
+    target.add_argument("--output", help="directory to write the restored databases to")
+    target.add_argument("--in-place", action="store_true", help="overwrite the live databases")
+    args = parser.parse_args()
+
+    if args.command == "snapshot":
+        result = snapshot(args.dir, args.pages, args.pause, args.prune_log)
+    elif args.command == "incremental":
+        result = incremental(args.dir)
+    elif args.command == "list":
+        result = list_backups(args.dir)
+    else:
+        result = restore(args.at, args.dir, args.output, args.in_place)
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,177 @@
+# benchmarks/bench_backup.py
+"""Benchmark online backups and restores on a large database.
+
+Usage:
+    python benchmarks/bench_backup.py [--size-gb 2] [--dir /scratch] [--keep]
+
+Builds a synthetic expenses database of about --size-gb (reused from --dir
+if it is already there), then measures, while a writer thread keeps adding
+expenses:
+
+- writer commit latency with no backup running,
+- a paged full snapshot (BACKUP_PAGES per step) and a one-step snapshot,
+- an incremental backup after a batch of updates and deletes,
+- restores as of the full snapshot and as of the incremental.
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Rows inserted per transaction while building the database
+BUILD_CHUNK = 200_000
+
+
+def build(path, size_gb, users=1000):
+    """Fill path with synthetic expenses until it reaches size_gb."""
+    from db_utils import init_db
+    from synthetic_data import generate_expenses, generate_users
+
+    db = init_db(path)
+    if os.path.getsize(path) >= size_gb * 1e9:
+        return db
+    db.execute("PRAGMA synchronous = OFF")
+    with db:
+        user_ids = [
+            db.execute("INSERT INTO users (name, email, password) VALUES (?, ?, 'x')", (name, None)).lastrowid
+            for name, _ in generate_users(users)
+        ]
+    seed = 0
+    while os.path.getsize(path) < size_gb * 1e9:
+        # Stamp rows with their expense date so they look like history to incrementals
+        rows = generate_expenses(user_ids, BUILD_CHUNK // users, seed, end_date=date(2025, 12, 31))
+        with db:
+            db.executemany(
+                "INSERT INTO expenses (user_id, amount, category, note, date, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (row + (row[4], row[4]) for row in rows)
+            )
+        seed += 1
+        print(f"\r  building: {os.path.getsize(path) / 1e9:.2f} GB", end="", flush=True)
+    print()
+    db.execute("PRAGMA synchronous = FULL")
+    return db
+
+
+class Writer(threading.Thread):
+    """Adds one expense per transaction, recording commit latency."""
+
+    def __init__(self, path, interval=0.005):
+        super().__init__(daemon=True)
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.interval = interval
+        self.latencies = []
+        self.running = True
+
+    def run(self):
+        while self.running:
+            start = time.perf_counter()
+            with self.db:
+                self.db.execute("INSERT INTO expenses (user_id, amount, category, note, date) "
+                                "VALUES (1, 9.99, 'Food', 'bench', '2025-12-31')")
+            self.latencies.append(time.perf_counter() - start)
+            time.sleep(self.interval)
+
+    def take(self):
+        """Return and reset the latencies recorded so far."""
+        latencies, self.latencies = self.latencies, []
+        return latencies
+
+
+def _latency(samples):
+    if not samples:
+        return "no writes"
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+    return f"{len(ordered)} writes, p50 {pick(0.5):.1f} ms, p99 {pick(0.99):.1f} ms, max {ordered[-1] * 1000:.1f} ms"
+
+
+def run(args):
+    # db_utils and backup read their paths at import time
+    os.environ["EXPENSE_DB_PATH"] = os.path.join(args.dir, "expenses.db")
+    os.environ["EXPENSE_SHARDS"] = "0"
+    sys.path.insert(0, os.path.dirname(ROOT))
+    sys.path.insert(0, ROOT)
+    import backup
+
+    path = os.environ["EXPENSE_DB_PATH"]
+    backup_dir = os.path.join(args.dir, "backups")
+    shutil.rmtree(backup_dir, ignore_errors=True)
+    db = build(path, args.size_gb)
+    size = os.path.getsize(path)
+    print(f"database: {size / 1e9:.2f} GB, {db.execute('SELECT MAX(id) FROM expenses').fetchone()[0]} expenses")
+
+    writer = Writer(path)
+    writer.start()
+    time.sleep(2)
+    print(f"{'no backup':<22}{'':>10}  {_latency(writer.take())}")
+
+    def report(name, result, seconds):
+        extra = ""
+        if "steps" in result:
+            extra = f", {result['steps']} steps, {result['restarts']} restarts"
+        print(f"{name:<22}{seconds:>8.2f} s  {size / 1e6 / seconds:.0f} MB/s{extra}")
+        print(f"{'':<34}{_latency(writer.take())}")
+
+    for name, pages in (("paged snapshot", backup.BACKUP_PAGES), ("one-step snapshot", -1)):
+        writer.take()
+        start = time.perf_counter()
+        result = backup.snapshot(backup_dir, pages=pages)["backups"][0]
+        report(name, result, time.perf_counter() - start)
+
+    # Change some rows, then capture them
+    time.sleep(1)
+    rng = random.Random(0)
+    max_id = db.execute("SELECT MAX(id) FROM expenses").fetchone()[0]
+    with db:
+        db.executemany("UPDATE expenses SET amount = amount + 1, updated_at = DATETIME('now') WHERE id = ?",
+                       [(rng.randrange(1, max_id),) for _ in range(args.changes)])
+        db.executemany("DELETE FROM expenses WHERE id = ?", [(rng.randrange(1, max_id),) for _ in range(args.changes // 10)])
+    writer.take()
+    start = time.perf_counter()
+    result = backup.incremental(backup_dir)["backups"][0]
+    seconds = time.perf_counter() - start
+    print(f"{'incremental':<22}{seconds:>8.2f} s  {result['changed']} changed, {result['deleted']} deleted, "
+          f"{result['bytes'] / 1e6:.1f} MB")
+    print(f"{'':<34}{_latency(writer.take())}")
+    writer.running = False
+    writer.join()
+
+    entries = backup.list_backups(backup_dir)["databases"]["main"]
+    for name, at in (("restore (full)", entries[1]["taken_at"]), ("restore (full + inc)", None)):
+        output = os.path.join(args.dir, "restored")
+        shutil.rmtree(output, ignore_errors=True)
+        start = time.perf_counter()
+        backup.restore(at, backup_dir, output=output)
+        seconds = time.perf_counter() - start
+        print(f"{name:<22}{seconds:>8.2f} s  {size / 1e6 / seconds:.0f} MB/s")
+
+    shutil.rmtree(backup_dir, ignore_errors=True)
+    shutil.rmtree(os.path.join(args.dir, "restored"), ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark backups and restores on a large database")
+    parser.add_argument("--size-gb", type=float, default=2.0)
+    parser.add_argument("--dir", help="scratch directory (default: a new temporary one)")
+    parser.add_argument("--changes", type=int, default=10_000, help="rows updated before the incremental")
+    parser.add_argument("--keep", action="store_true", help="keep the database for the next run")
+    args = parser.parse_args()
+
+    created = not args.dir
+    args.dir = args.dir or tempfile.mkdtemp(prefix="expense-backup-bench-")
+    try:
+        run(args)
+    finally:
+        if created and not args.keep:
+            shutil.rmtree(args.dir, ignore_errors=True)
+        elif args.keep:
+            print(f"database kept in {args.dir}")
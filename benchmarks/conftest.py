@@ -0,0 +1,158 @@
+# benchmarks/conftest.py
+"""Shared fixtures for the pytest-benchmark suite.
+
+Everything runs in process against a scratch database filled by
+synthetic_data.populate(); nothing touches expenses.db or the network.
+
+    pytest benchmarks                                   # run
+    pytest benchmarks --benchmark-json=run.json --memory-save
+    python benchmarks/merge_baseline.py run.json        # record baselines of new benchmarks
+    pytest benchmarks --benchmark-compare --benchmark-compare-fail=mean:25% --memory-compare
+                                                        # fail on regressions
+
+Timing baselines are stored by pytest-benchmark under benchmarks/baselines;
+peak memory baselines live in benchmarks/baselines/memory.json. Saving only
+adds benchmarks that have no baseline yet; re-recording existing ones takes
+--replace / --memory-replace and belongs in a commit of its own. Dataset size
+is set by BENCH_USERS and BENCH_EXPENSES_PER_USER (baselines use the defaults).
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+from datetime import date
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_DIR = os.path.join(ROOT, "benchmarks", "baselines")
+MEMORY_BASELINE = os.path.join(BASELINE_DIR, "memory.json")
+# Allowed growth of peak memory over the baseline before --memory-compare fails
+MEMORY_TOLERANCE = 1.25
+MEMORY_SLACK_KIB = 16
+
+BENCH_USERS = int(os.getenv("BENCH_USERS", "50"))
+BENCH_EXPENSES_PER_USER = int(os.getenv("BENCH_EXPENSES_PER_USER", "200"))
+# Fixed so the dataset (and the date ranges below) never depend on today
+END_DATE = date(2025, 12, 31)
+MONTH = ("2025-12-01", "2025-12-31")
+YEAR = ("2025-01-01", "2025-12-31")
+
+# db_utils opens its database at import time, so redirect it first
+_scratch = tempfile.mkdtemp(prefix="expense-bench-")
+os.environ["EXPENSE_DB_PATH"] = os.path.join(_scratch, "expenses.db")
+os.environ["EXPENSE_SHARDS"] = "0"
+os.environ["EXPENSE_SHARD_DIR"] = os.path.join(_scratch, "shards")
+os.environ["EXPENSE_EXPORT_DIR"] = os.path.join(_scratch, "exports")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import db_utils  # noqa: E402
+from synthetic_data import populate  # noqa: E402
+
+_peaks = {}
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("memory baselines")
+    group.addoption("--memory-save", action="store_true", help="add peak memory baselines of new benchmarks")
+    group.addoption("--memory-replace", action="store_true", help="with --memory-save, re-record existing baselines too")
+    group.addoption("--memory-compare", action="store_true", help="fail if peak memory regresses")
+
+
+@pytest.fixture(scope="session")
+def dataset():
+    """Populate the scratch database once; return the synthetic user ids."""
+    return populate(db_utils.conn, BENCH_USERS, BENCH_EXPENSES_PER_USER, end_date=END_DATE)
+
+
+@pytest.fixture(scope="session")
+def reader_id(dataset):
+    """A user whose expenses are only ever read."""
+    return dataset[0]
+
+
+@pytest.fixture(scope="session")
+def writer_id(dataset):
+    """A user that benchmarks are free to add, edit and delete expenses for."""
+    return dataset[-1]
+
+
+@pytest.fixture
+def bench(benchmark, request):
+    """Benchmark fn(*args, **kwargs), recording its peak traced memory first.
+
+    Pass setup= (returning (args, kwargs) for each round, as in
+    benchmark.pedantic) for calls that consume state, such as deletes; those
+    run 20 rounds unless rounds= says otherwise. Without setup, rounds= pins
+    the round count instead of letting pytest-benchmark calibrate it: slow
+    calls use it, and so must every benchmark that adds rows, so that the
+    data later benchmarks read is the same size however fast the writes ran.
+    """
+    def run(fn, *args, setup=None, rounds=None, **kwargs):
+        call_args, call_kwargs = setup() if setup else (args, kwargs)
+        tracemalloc.start()
+        try:
+            fn(*call_args, **call_kwargs)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        _peaks[request.node.nodeid] = round(peak / 1024, 1)
+        benchmark.extra_info["peak_memory_kib"] = _peaks[request.node.nodeid]
+        if setup:
+            return benchmark.pedantic(fn, setup=setup, rounds=rounds or 20)
+        if rounds:
+            return benchmark.pedantic(fn, args=args, kwargs=kwargs, rounds=rounds)
+        return benchmark(fn, *args, **kwargs)
+    return run
+
+
+@pytest.fixture(scope="session")
+def mcp_call(dataset):
+    """Call a main.py MCP tool through the FastMCP in-memory client."""
+    from fastmcp import Client
+    import main
+
+    loop = asyncio.new_event_loop()
+    client = Client(main.mcp)
+    loop.run_until_complete(client.__aenter__())
+
+    def call(name, arguments):
+        return loop.run_until_complete(client.call_tool(name, arguments)).data
+
+    yield call
+    loop.run_until_complete(client.__aexit__(None, None, None))
+    loop.close()
+
+
+def pytest_sessionfinish(session, exitstatus):
+    config = session.config
+    if not _peaks:
+        return
+    if config.getoption("--memory-save"):
+        saved = {}
+        if os.path.exists(MEMORY_BASELINE):
+            with open(MEMORY_BASELINE) as f:
+                saved = json.load(f)
+        replace = config.getoption("--memory-replace")
+        saved.update({test: peak for test, peak in _peaks.items() if replace or test not in saved})
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(MEMORY_BASELINE, "w") as f:
+            json.dump(dict(sorted(saved.items())), f, indent=2)
+            f.write("\n")
+    if config.getoption("--memory-compare") and os.path.exists(MEMORY_BASELINE):
+        with open(MEMORY_BASELINE) as f:
+            baseline = json.load(f)
+        regressions = [
+            f"{test}: {peak} KiB (baseline {baseline[test]} KiB)"
+            for test, peak in sorted(_peaks.items())
+            if test in baseline and peak > baseline[test] * MEMORY_TOLERANCE + MEMORY_SLACK_KIB
+        ]
+        if regressions:
+            reporter = config.pluginmanager.get_plugin("terminalreporter")
+            reporter.write_line("Peak memory regressions:", red=True)
+            for line in regressions:
+                reporter.write_line("  " + line, red=True)
+            session.exitstatus = pytest.ExitCode.TESTS_FAILED
@@ -0,0 +1,75 @@
+# benchmarks/measure_encoding.py
+"""Report bytes and tokens saved by the compact tool result encoding.
+
+Usage:
+    python benchmarks/measure_encoding.py [--sizes 10 50 200 1000 5000]
+
+For each dataset size (expenses for one user over a year of synthetic data)
+the list_expenses and get_expense_analysis tools are called with and without
+compact=True, and the JSON the model would receive is measured. Tokens are
+counted with tiktoken's cl100k_base when it is installed, otherwise
+estimated as bytes / 4.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+from datetime import date
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _token_counter():
+    try:
+        import tiktoken
+    except ImportError:
+        return "bytes/4", lambda text: len(text.encode("utf-8")) // 4
+    encoding = tiktoken.get_encoding("cl100k_base")
+    return "cl100k_base", lambda text: len(encoding.encode(text))
+
+
+def measure(sizes):
+    """Return [(size, case, full_bytes, compact_bytes, full_tokens, compact_tokens)]."""
+    # db_utils opens its database at import time, so redirect it first
+    os.environ["EXPENSE_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="expense-encoding-"), "expenses.db")
+    os.environ["EXPENSE_SHARDS"] = "0"
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    import db_utils
+    import main
+    from synthetic_data import populate
+
+    _, count_tokens = _token_counter()
+    password_hash = db_utils.hash_password("password")
+    cases = {
+        "list_expenses": lambda uid, compact: main.list_expenses.fn(uid, compact=compact),
+        "analysis by category": lambda uid, compact: main.get_expense_analysis.fn(uid, compact=compact),
+        "analysis by date": lambda uid, compact: main.get_expense_analysis.fn(uid, group_by="date", compact=compact),
+    }
+
+    rows = []
+    for seed, size in enumerate(sizes):
+        user_id = populate(db_utils.conn, 1, size, seed=seed, end_date=date(2025, 12, 31),
+                           password_hash=password_hash)[0]
+        # populate() numbers emails from 0, so free the address for the next size
+        db_utils.conn.execute("UPDATE users SET email = NULL WHERE id = ?", (user_id,))
+        for case, call in cases.items():
+            full = json.dumps(call(user_id, False))
+            compact = json.dumps(call(user_id, True))
+            rows.append((size, case, len(full), len(compact), count_tokens(full), count_tokens(compact)))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure compact tool result encoding savings")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 50, 200, 1000, 5000])
+    args = parser.parse_args()
+
+    tokenizer, _ = _token_counter()
+    print(f"{'expenses':>8}  {'result':<22}{'bytes':>9}{'compact':>9}{'tokens':>9}{'compact':>9}{'saved':>7}")
+    for size, case, full_b, compact_b, full_t, compact_t in measure(args.sizes):
+        saved = 100 * (1 - compact_t / full_t)
+        print(f"{size:>8}  {case:<22}{full_b:>9}{compact_b:>9}{full_t:>9}{compact_t:>9}{saved:>6.0f}%")
+    print(f"(tokens: {tokenizer})")
@@ -0,0 +1,50 @@
+# benchmarks/merge_baseline.py
+"""Add new benchmarks to the stored timing baseline without touching the others.
+
+Usage:
+    pytest benchmarks --benchmark-json=run.json --memory-save
+    python benchmarks/merge_baseline.py run.json
+
+Only benchmarks that have no baseline yet are copied from run.json, so a
+change cannot quietly re-baseline the benchmarks it slows down. To re-record
+existing ones on purpose (in a commit of its own that says why), select them
+with -k when running pytest and pass --replace.
+"""
+import argparse
+import json
+import os
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "baselines", "Linux-CPython-3.12-64bit", "0001_baseline.json")
+
+
+def merge(run, baseline, replace=False):
+    """Merge the benchmarks of `run` into `baseline` (both parsed JSON); return the names changed."""
+    stored = {bench["fullname"]: bench for bench in baseline["benchmarks"]}
+    changed = []
+    for bench in run["benchmarks"]:
+        if bench["fullname"] not in stored or replace:
+            # --benchmark-json keeps every round's timing; saved baselines don't
+            bench["stats"].pop("data", None)
+            stored[bench["fullname"]] = bench
+            changed.append(bench["fullname"])
+    baseline["benchmarks"] = sorted(stored.values(), key=lambda bench: bench["fullname"])
+    return changed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge a benchmark run into the stored baseline")
+    parser.add_argument("run", help="JSON written by pytest --benchmark-json")
+    parser.add_argument("--replace", action="store_true", help="re-record benchmarks that already have a baseline")
+    args = parser.parse_args()
+
+    with open(args.run) as f:
+        run = json.load(f)
+    with open(BASELINE) as f:
+        baseline = json.load(f)
+    changed = merge(run, baseline, args.replace)
+    with open(BASELINE, "w") as f:
+        json.dump(baseline, f, indent=4)
+    print(f"{len(changed)} benchmark(s) {'re-recorded' if args.replace else 'added'}")
+    for name in changed:
+        print(f"  {name}")
@@ -0,0 +1,100 @@
+# benchmarks/synthetic_data.py
+"""Deterministic synthetic users and expenses for benchmarks.
+
+Usage:
+    python benchmarks/synthetic_data.py --db scratch.db --users 100 --expenses-per-user 500
+
+Every generated user has the password PASSWORD.
+"""
+import argparse
+import math
+import random
+from datetime import date, timedelta
+
+PASSWORD = "password"
+
+# category -> (share of expenses, median amount, typical notes)
+CATEGORIES = {
+    "Food": (0.28, 15, ["dinner", "lunch", "breakfast", "coffee", "pizza", "burger", "snacks", "cafe"]),
+    "Groceries": (0.18, 45, ["groceries", "supermarket", "vegetables", "fruits", "dairy", "meat"]),
+    "Transport": (0.16, 12, ["uber", "taxi", "bus", "metro", "fuel", "parking", "train"]),
+    "Entertainment": (0.08, 25, ["movie tickets", "netflix", "spotify", "concert", "game", "party"]),
+    "Shopping": (0.08, 60, ["clothes", "shoes", "amazon", "electronics", "gadgets"]),
+    "Utilities": (0.06, 70, ["electricity", "water", "internet", "phone bill", "gas bill"]),
+    "Healthcare": (0.05, 40, ["pharmacy", "doctor", "medicine", "clinic"]),
+    "Travel": (0.04, 250, ["flight", "hotel", "airbnb", "trip"]),
+    "Education": (0.03, 80, ["books", "course", "tuition"]),
+    "Rent": (0.02, 1200, ["rent"]),
+    "Other": (0.02, 30, [None, "misc", "gift"]),
+}
+
+
+def generate_users(count, seed=42):
+    """Return [(name, email)] for `count` users."""
+    rng = random.Random(seed)
+    first = ["Asha", "Ben", "Chen", "Dina", "Eli", "Farah", "Gus", "Hana", "Ivan", "Jia", "Kofi", "Lena"]
+    last = ["Khan", "Smith", "Li", "Garcia", "Okafor", "Novak", "Singh", "Rossi", "Kim", "Malik"]
+    return [(f"{rng.choice(first)} {rng.choice(last)}", f"user{i}@example.com") for i in range(count)]
+
+
+def generate_expenses(user_ids, per_user, seed=42, days=365, end_date=None):
+    """Yield (user_id, amount, category, note, date) rows.
+
+    Categories follow CATEGORIES' shares, amounts are log-normal around each
+    category's median, about a fifth of the notes are empty and dates are
+    spread over the `days` days ending at end_date (default today).
+    """
+    rng = random.Random(seed)
+    end_date = end_date or date.today()
+    names = list(CATEGORIES)
+    weights = [CATEGORIES[name][0] for name in names]
+
+    for user_id in user_ids:
+        for category in rng.choices(names, weights, k=per_user):
+            _, median, notes = CATEGORIES[category]
+            amount = round(rng.lognormvariate(math.log(median), 0.6), 2)
+            note = rng.choice(notes) if rng.random() > 0.2 else None
+            day = end_date - timedelta(days=rng.randrange(days))
+            yield (user_id, amount, category, note, day.isoformat())
+
+
+def populate(conn, users=50, per_user=200, seed=42, days=365, end_date=None, password_hash=None):
+    """Fill `conn` (an init_db() database) with synthetic data; return the new user ids."""
+    if password_hash is None:
+        from db_utils import hash_password
+        password_hash = hash_password(PASSWORD)
+
+    user_ids = []
+    with conn:
+        for name, email in generate_users(users, seed):
+            cur = conn.execute(
+                "INSERT INTO users (name, email, password) VALUES (?, ?, ?)",
+                (name, email, password_hash)
+            )
+            user_ids.append(cur.lastrowid)
+        conn.executemany(
+            "INSERT INTO expenses (user_id, amount, category, note, date) VALUES (?, ?, ?, ?, ?)",
+            generate_expenses(user_ids, per_user, seed, days, end_date)
+        )
+    return user_ids
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+
+    parser = argparse.ArgumentParser(description="Generate a synthetic expenses database")
+    parser.add_argument("--db", required=True, help="SQLite file to create")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--expenses-per-user", type=int, default=200)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    # Point db_utils at the target file before importing it
+    os.environ["EXPENSE_DB_PATH"] = args.db
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from db_utils import init_db
+
+    ids = populate(init_db(args.db), args.users, args.expenses_per_user, args.seed, args.days)
+    print(f"Wrote {len(ids)} users and {len(ids) * args.expenses_per_user} expenses to {args.db}")
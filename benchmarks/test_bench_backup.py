@@ -0,0 +1,76 @@
+# benchmarks/test_bench_backup.py
+"""Benchmarks for online backups and restores of the scratch database.
+
+benchmarks/bench_backup.py measures the same operations on a multi-GB
+database with a concurrent writer.
+"""
+import os
+import sqlite3
+import time
+
+import pytest
+
+import backup
+import db_utils
+from conftest import END_DATE
+from synthetic_data import populate
+
+
+@pytest.fixture(scope="module")
+def backup_dir(dataset, tmp_path_factory):
+    """A backup directory holding one full snapshot of the scratch database."""
+    path = str(tmp_path_factory.mktemp("backups"))
+    backup.snapshot(path)
+    return path
+
+
+def test_backup_snapshot(bench, dataset, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("snapshots"))
+    bench(backup.snapshot, path, rounds=10)
+
+
+def test_backup_incremental(bench, backup_dir, writer_id):
+    def changed():
+        db_utils.add_expense(writer_id, 4.5, "Food", "coffee", "2025-11-30")
+        return (backup_dir,), {}
+    bench(backup.incremental, setup=changed, rounds=10)
+
+
+def test_backup_restore(bench, backup_dir, tmp_path_factory):
+    output = str(tmp_path_factory.mktemp("restored"))
+    bench(backup.restore, backup_dir=backup_dir, output=output, rounds=10)
+
+
+def _count(path):
+    with sqlite3.connect(path) as db:
+        return db.execute("SELECT COUNT(*) FROM expenses").fetchone()[0]
+
+
+def test_restore_before_a_shard_existed(tmp_path):
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(db_utils, "DB_PATH", str(tmp_path / "expenses.db"))
+        mp.setattr(db_utils, "conn", db_utils.init_db(db_utils.DB_PATH))
+        mp.setattr(db_utils, "SHARD_COUNT", 2)
+        mp.setattr(db_utils, "SHARD_DIR", str(tmp_path / "shards"))
+        mp.setattr(db_utils, "_shard_conns", {})
+        user_id = populate(db_utils.conn, 2, 5, end_date=END_DATE)[0]
+        backup_dir = str(tmp_path / "backups")
+        at = backup.snapshot(backup_dir)["backups"][0]["taken_at"]
+        time.sleep(1.1)  # backup times have one-second resolution
+
+        # Creates shard0, whose first backup is then later than `at`
+        assert db_utils.move_user_expenses(user_id, 0)["ok"]
+        backup.incremental(backup_dir)
+        shard0 = db_utils.shard_path(0)
+
+        result = backup.restore(at, backup_dir, output=str(tmp_path / "restored"))
+        assert result["ok"], result["message"]
+        restored = {entry["database"]: entry["path"] for entry in result["restored"]}
+        assert _count(restored["main"]) == 10
+        assert _count(restored["shard0"]) == 0
+
+        result = backup.restore(at, backup_dir, in_place=True)
+        assert result["ok"], result["message"]
+        assert _count(db_utils.DB_PATH) == 10
+        assert _count(shard0) == 0
+        assert not os.path.exists(shard0 + ".restore")
@@ -0,0 +1,80 @@
+# benchmarks/test_bench_db_utils.py
+"""Benchmarks for the db_utils functions on an unsharded database."""
+import itertools
+
+import db_utils
+from conftest import MONTH, YEAR
+from synthetic_data import PASSWORD
+
+_emails = itertools.count()
+
+
+def test_init_db(bench):
+    bench(lambda: db_utils.init_db(db_utils.DB_PATH).close())
+
+
+def test_hash_password(bench):
+    # bcrypt is deliberately slow, so keep the round count low
+    bench(db_utils.hash_password, setup=lambda: ((PASSWORD,), {}), rounds=5)
+
+
+def test_verify_password(bench):
+    hashed = db_utils.hash_password(PASSWORD)
+    bench(db_utils.verify_password, setup=lambda: ((PASSWORD, hashed), {}), rounds=5)
+
+
+def test_register_user(bench, dataset):
+    def setup():
+        return ("Bench User", f"bench{next(_emails)}@example.com", PASSWORD), {}
+    bench(db_utils.register_user, setup=setup, rounds=5)
+
+
+def test_login_user(bench, dataset):
+    bench(db_utils.login_user, setup=lambda: (("user0@example.com", PASSWORD), {}), rounds=5)
+
+
+def test_add_expense(bench, writer_id):
+    bench(db_utils.add_expense, writer_id, 12.5, "Food", "lunch", "2025-12-15", rounds=200)
+
+
+def test_batch_add_expenses(bench, writer_id):
+    def add_ten():
+        with db_utils.batch(writer_id):
+            for _ in range(10):
+                db_utils.add_expense(writer_id, 12.5, "Food", "lunch", "2025-12-15")
+    bench(add_ten, rounds=100)
+
+
+def test_list_expenses_all(bench, reader_id):
+    bench(db_utils.list_expenses, reader_id)
+
+
+def test_list_expenses_month(bench, reader_id):
+    bench(db_utils.list_expenses, reader_id, *MONTH)
+
+
+def test_update_expense(bench, writer_id):
+    expense_id = db_utils.add_expense(writer_id, 10, "Food", "dinner", "2025-12-15")
+    bench(db_utils.update_expense, writer_id, expense_id, amount=11, note="late dinner")
+
+
+def test_delete_expense(bench, writer_id):
+    def setup():
+        return (writer_id, db_utils.add_expense(writer_id, 10, "Food", "snacks", "2025-12-15")), {}
+    bench(db_utils.delete_expense, setup=setup, rounds=50)
+
+
+def test_analytics_by_category(bench, reader_id):
+    bench(db_utils.get_expense_analytics, reader_id, *YEAR, group_by="category")
+
+
+def test_analytics_by_date(bench, reader_id):
+    bench(db_utils.get_expense_analytics, reader_id, *YEAR, group_by="date")
+
+
+def test_analytics_by_month(bench, reader_id):
+    bench(db_utils.get_expense_analytics, reader_id, group_by="month")
+
+
+def test_admin_expense_summary(bench, dataset):
+    bench(db_utils.admin_expense_summary, *YEAR)
@@ -0,0 +1,153 @@
+# benchmarks/test_bench_gateway.py
+"""Overhead of the model gateway itself, measured against an instant FakeBackend,
+and checks of its retry, hedging, deadline and coalescing behaviour and of the
+chat tool loop built on it."""
+import asyncio
+import time
+
+import pytest
+from google.genai import types
+
+from utils.model_gateway import FakeBackend, GatewayTimeout, ModelGateway
+from utils.query_cache import extract_tool_plan
+from utils.tool_loop import run_tool_loop
+
+
+class RateLimited(Exception):
+    code = 429
+
+
+@pytest.fixture
+def gateway():
+    return ModelGateway(FakeBackend(), rate=1e6, burst=1000)
+
+
+def test_gateway_send_once(bench, gateway):
+    bench(gateway.generate_content, model="fake", contents="list my expenses", label="bench")
+
+
+def test_gateway_idempotent_hedged(bench, gateway):
+    bench(gateway.generate_content, model="fake", contents="list my expenses", idempotent=True, label="bench")
+
+
+def test_gateway_coalesced(bench, gateway):
+    bench(gateway.generate_content, model="fake", contents="list my expenses", coalesce_key="bench", label="bench")
+
+
+def _gateway(backend, **kwargs):
+    return ModelGateway(backend, rate=1e6, burst=1000, base_delay=0.001, **kwargs)
+
+
+@pytest.mark.parametrize("idempotent, calls", [(True, 3), (False, 1)])
+def test_gateway_retries_only_idempotent_calls(idempotent, calls):
+    backend = FakeBackend(failures=[RateLimited("429"), RateLimited("429")])
+    gateway = _gateway(backend)
+    if idempotent:
+        assert gateway.generate_content(contents="hi", idempotent=True).text == "echo: hi"
+    else:
+        with pytest.raises(RateLimited):
+            gateway.generate_content(contents="hi")
+    assert backend.calls == calls
+
+
+def test_gateway_does_not_retry_other_errors():
+    backend = FakeBackend(failures=[ValueError("bad request")])
+    with pytest.raises(ValueError):
+        _gateway(backend).generate_content(contents="hi", idempotent=True)
+    assert backend.calls == 1
+
+
+@pytest.mark.parametrize("idempotent, calls", [(True, 2), (False, 1)])
+def test_gateway_hedges_only_idempotent_calls(idempotent, calls):
+    latencies = iter([0.5, 0.01])
+    backend = FakeBackend(latency=lambda: next(latencies, 0.01))
+    gateway = _gateway(backend, hedge_after=0.05)
+    start = time.perf_counter()
+    gateway.generate_content(contents="hi", idempotent=idempotent)
+    elapsed = time.perf_counter() - start
+    assert backend.calls == calls
+    # The hedge answers long before the slow first attempt would have
+    assert (elapsed < 0.3) == idempotent
+
+
+def test_gateway_deadline():
+    backend = FakeBackend(latency=0.5)
+    with pytest.raises(GatewayTimeout):
+        _gateway(backend, hedge_after=0).generate_content(contents="hi", idempotent=True, deadline=0.05)
+
+
+def test_gateway_deadline_covers_retries():
+    backend = FakeBackend(failures=[RateLimited("429")] * 10)
+    gateway = ModelGateway(backend, rate=1e6, burst=1000, retries=10, base_delay=0.05, max_delay=0.05)
+    with pytest.raises(GatewayTimeout):
+        gateway.generate_content(contents="hi", idempotent=True, deadline=0.1)
+    assert backend.calls < 10
+
+
+@pytest.mark.parametrize("coalesce_key, calls", [("same prompt", 1), (None, 3)])
+def test_gateway_coalesces_overlapping_calls(coalesce_key, calls):
+    backend = FakeBackend(latency=0.05)
+    gateway = _gateway(backend)
+
+    async def overlapping():
+        return await asyncio.gather(*[
+            gateway.agenerate_content(contents="hi", coalesce_key=coalesce_key) for _ in range(3)
+        ])
+
+    results = asyncio.run(overlapping())
+    assert [result.text for result in results] == ["echo: hi"] * 3
+    assert backend.calls == calls
+
+
+def test_gateway_coalesced_calls_share_failures():
+    backend = FakeBackend(latency=0.05, failures=[RateLimited("429")])
+    gateway = _gateway(backend)
+
+    async def overlapping():
+        return await asyncio.gather(*[
+            gateway.agenerate_content(contents="hi", coalesce_key="same prompt") for _ in range(2)
+        ], return_exceptions=True)
+
+    assert all(isinstance(result, RateLimited) for result in asyncio.run(overlapping()))
+    assert backend.calls == 1
+
+
+def test_gateway_sends_uploads_once():
+    # voice_models sends file uploads like this: each attempt would create another file
+    attempts = []
+
+    def upload():
+        attempts.append(1)
+        raise RateLimited("429")
+
+    with pytest.raises(RateLimited):
+        _gateway(FakeBackend(), hedge_after=0.01).call(upload, label="upload")
+    assert len(attempts) == 1
+
+
+def _model_reply(contents):
+    """Ask for one add_expense call, then answer once the tool result is in the conversation."""
+    if len(contents) == 1:
+        part = types.Part(function_call=types.FunctionCall(name="add_expense", args={"amount": 50}))
+    else:
+        part = types.Part.from_text(text=f"Added: {contents[-1].parts[0].function_response.response}")
+    return types.GenerateContentResponse(candidates=[types.Candidate(content=types.Content(role="model", parts=[part]))])
+
+
+def test_tool_loop_runs_each_tool_call_once():
+    # The first round trip fails once with a 429, then its retry is slow enough to be hedged
+    latencies = iter([0.0, 0.3, 0.0])
+    backend = FakeBackend(lambda contents, **kwargs: _model_reply(contents), latency=lambda: next(latencies, 0.0),
+                          failures=[RateLimited("429")])
+    gateway = _gateway(backend, hedge_after=0.05)
+    tool_calls = []
+
+    async def call_tool(name, args):
+        tool_calls.append((name, args))
+        return {"result": {"ok": True, "id": 1}}
+
+    response, history = asyncio.run(run_tool_loop(gateway, call_tool, "add 50 for uber", model="fake", config=None))
+    assert backend.calls == 4  # failed, slow and hedged attempts of the first round trip, then the answer
+    assert tool_calls == [("add_expense", {"amount": 50})]
+    assert response.text == "Added: {'result': {'ok': True, 'id': 1}}"
+    assert extract_tool_plan(history) == [("add_expense", {"amount": 50})]
@@ -0,0 +1,91 @@
+# benchmarks/test_bench_jobs.py
+"""Benchmarks and checks for the background job handlers, run in process with jobs.run_next()."""
+import pytest
+
+import db_utils
+import jobs
+
+
+@pytest.fixture
+def drained(dataset):
+    """Run any jobs left queued by other benchmarks so run_next() picks ours."""
+    while jobs.run_next():
+        pass
+
+
+def _queued(user_id, kind, params=None):
+    def setup():
+        jobs.submit_job(user_id, kind, params)
+        return (), {}
+    return setup
+
+
+def test_job_analysis(bench, drained, reader_id):
+    bench(jobs.run_next, setup=_queued(reader_id, "analysis"), rounds=20)
+
+
+def test_job_export(bench, drained, reader_id):
+    bench(jobs.run_next, setup=_queued(reader_id, "export"), rounds=20)
+
+
+def test_job_recategorize_dry_run(bench, drained, reader_id):
+    bench(jobs.run_next, setup=_queued(reader_id, "recategorize", {"dry_run": True}), rounds=20)
+
+
+def test_job_import(bench, drained, writer_id):
+    rows = [{"amount": 12.5, "category": "Food", "note": "lunch", "date": "2025-12-15"}] * 1000
+    bench(jobs.run_next, setup=_queued(writer_id, "import", {"rows": rows}), rounds=10)
+
+
+def test_requeue_only_dead_pools(drained, reader_id):
+    live_id = jobs.submit_job(reader_id, "analysis")["job_id"]
+    dead_id = jobs.submit_job(reader_id, "analysis")["job_id"]
+    assert jobs._claim_next("live-0").id == live_id
+    assert jobs._claim_next("dead-0").id == dead_id
+    with jobs.conn:
+        jobs.conn.execute("UPDATE jobs SET heartbeat_at = DATETIME('now', '-1 hour') WHERE id = ?", (dead_id,))
+
+    assert jobs.requeue_stale_jobs() == 1
+    assert jobs.get_job(reader_id, live_id)["status"] == "running"
+    assert jobs.get_job(reader_id, dead_id)["status"] == "queued"
+    with jobs.conn:
+        jobs.conn.execute("DELETE FROM jobs WHERE id IN (?, ?)", (live_id, dead_id))
+
+
+class _PoolDied(BaseException):
+    """Stands in for the worker process dying mid-job."""
+
+
+def test_import_resumes_after_requeue(drained, writer_id, monkeypatch):
+    row = {"amount": 3.0, "category": "Food", "note": "resume-check", "date": "2025-12-20"}
+    rows = [row] * (jobs.CHUNK_SIZE * 2 + 10)
+    job_id = jobs.submit_job(writer_id, "import", {"rows": rows})["job_id"]
+    report = jobs.Job.report
+
+    def die_after_first_chunk(job, progress, message=None):
+        if progress > 0:
+            raise _PoolDied()
+        report(job, progress, message)
+
+    monkeypatch.setattr(jobs.Job, "report", die_after_first_chunk)
+    with pytest.raises(_PoolDied):
+        jobs.run_next("dead-0")
+    monkeypatch.setattr(jobs.Job, "report", report)
+    with jobs.conn:
+        jobs.conn.execute("UPDATE jobs SET heartbeat_at = DATETIME('now', '-1 hour') WHERE id = ?", (job_id,))
+    assert jobs.requeue_stale_jobs() == 1
+    assert jobs.run_next()
+
+    assert jobs.get_job_result(writer_id, job_id)["result"] == {"imported": len(rows)}
+    imported = [exp for exp in db_utils.list_expenses(writer_id) if exp["note"] == "resume-check"]
+    assert len(imported) == len(rows)
+    with db_utils.batch(writer_id):
+        for exp in imported:
+            db_utils.delete_expense(writer_id, exp["id"])
+
+
+def test_import_rejects_non_positive_amounts(writer_id):
+    rows = [{"amount": 5.0, "category": "Food"}, {"amount": 0, "category": "Food"}, {"amount": -2.5, "category": "Food"}]
+    result = jobs.submit_job(writer_id, "import", {"rows": rows})
+    assert not result["ok"]
+    assert "[1, 2]" in result["message"]
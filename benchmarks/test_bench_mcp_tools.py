@@ -0,0 +1,104 @@
+# benchmarks/test_bench_mcp_tools.py
+"""Benchmarks for the main.py MCP tools, called through the in-memory FastMCP client."""
+from conftest import MONTH, YEAR
+
+import db_utils
+import jobs
+import main
+
+
+def test_tool_add_expense(bench, mcp_call, writer_id):
+    bench(mcp_call, "add_expense", {
+        "user_id": writer_id, "amount": 50, "category": "Transport", "note": "uber", "date": "2025-12-15"
+    }, rounds=100)
+
+
+def test_tool_list_expenses_all(bench, mcp_call, reader_id):
+    bench(mcp_call, "list_expenses", {"user_id": reader_id})
+
+
+def test_tool_list_expenses_month(bench, mcp_call, reader_id):
+    bench(mcp_call, "list_expenses", {"user_id": reader_id, "start_date": MONTH[0], "end_date": MONTH[1]})
+
+
+def test_tool_list_expenses_all_compact(bench, mcp_call, reader_id):
+    bench(mcp_call, "list_expenses", {"user_id": reader_id, "compact": True})
+
+
+def test_tool_edit_expense(bench, mcp_call, writer_id):
+    expense_id = db_utils.add_expense(writer_id, 10, "Food", "dinner", "2025-12-15")
+    bench(mcp_call, "edit_expense", {"user_id": writer_id, "expense_id": expense_id, "amount": 12})
+
+
+def test_tool_delete_expense(bench, mcp_call, writer_id):
+    def setup():
+        expense_id = db_utils.add_expense(writer_id, 10, "Food", "snacks", "2025-12-15")
+        return ("delete_expense", {"user_id": writer_id, "expense_id": expense_id}), {}
+    bench(mcp_call, setup=setup, rounds=50)
+
+
+def test_tool_get_expense_analysis(bench, mcp_call, reader_id):
+    bench(mcp_call, "get_expense_analysis", {
+        "user_id": reader_id, "start_date": YEAR[0], "end_date": YEAR[1], "group_by": "month"
+    })
+
+
+def test_tool_get_expense_analysis_by_date_compact(bench, mcp_call, reader_id):
+    bench(mcp_call, "get_expense_analysis", {"user_id": reader_id, "group_by": "date", "compact": True})
+
+
+def test_tool_execute_batch(bench, mcp_call, writer_id):
+    result = bench(mcp_call, "execute_batch", {"user_id": writer_id, "operations": [
+        {"op": "add", "amount": 50, "category": "Transport", "note": "uber", "date": "2025-12-15"},
+        {"op": "add", "amount": 200, "category": "Groceries", "note": "groceries", "date": "2025-12-15"},
+        # November: the writer's synthetic rows only, untouched by the writes above
+        {"op": "list", "start_date": "2025-11-01", "end_date": "2025-11-30"},
+        {"op": "list", "start_date": "2025-11-01", "end_date": "2025-11-30", "compact": True},
+        {"op": "analyze", "start_date": "2025-11-01", "end_date": "2025-11-30", "compact": True},
+    ]}, rounds=50)
+    assert result["ok"], result["message"]
+
+
+def test_execute_batch_rolls_back_on_database_errors(writer_id):
+    before = db_utils.list_expenses(writer_id)
+    result = main.execute_batch.fn(writer_id, [
+        main.BatchOperation(op="add", amount=5, category="Food", date="2025-12-20"),
+        main.BatchOperation(op="add", amount=float("nan"), category="Food", date="2025-12-20"),  # NOT NULL fails
+    ])
+    assert not result["ok"]
+    assert result["message"].startswith("Batch rolled back")
+    assert db_utils.list_expenses(writer_id) == before
+
+    # Validation failures are per operation and don't undo the others
+    result = main.execute_batch.fn(writer_id, [
+        main.BatchOperation(op="add", amount=5, category="Food", date="2025-12-20"),
+        main.BatchOperation(op="add", amount=-5, category="Food", date="2025-12-20"),
+    ])
+    assert [op["ok"] for op in result["results"]] == [True, False]
+    assert db_utils.delete_expense(writer_id, result["results"][0]["id"])["ok"]
+
+
+def test_tool_submit_job(bench, mcp_call, writer_id):
+    bench(mcp_call, "submit_job", {"user_id": writer_id, "kind": "analysis"}, rounds=100)
+    # Don't leave the benchmark's jobs for later tests to run
+    with jobs.conn:
+        jobs.conn.execute("DELETE FROM jobs WHERE status = 'queued'")
+
+
+def test_tool_job_status(bench, mcp_call, writer_id):
+    job_id = mcp_call("submit_job", {"user_id": writer_id, "kind": "analysis"})["job_id"]
+    bench(mcp_call, "job_status", {"user_id": writer_id, "job_id": job_id})
+
+
+def test_tool_job_result(bench, mcp_call, writer_id):
+    job_id = mcp_call("submit_job", {"user_id": writer_id, "kind": "analysis"})["job_id"]
+    while jobs.run_next():
+        pass
+    bench(mcp_call, "job_result", {"user_id": writer_id, "job_id": job_id})
+
+
+def test_tool_cancel_job(bench, mcp_call, writer_id):
+    def setup():
+        job_id = mcp_call("submit_job", {"user_id": writer_id, "kind": "analysis"})["job_id"]
+        return ("cancel_job", {"user_id": writer_id, "job_id": job_id}), {}
+    bench(mcp_call, setup=setup, rounds=50)
@@ -0,0 +1,113 @@
+# benchmarks/test_bench_sharding.py
+"""Benchmarks for the db_utils shard router, on a separate sharded database."""
+import itertools
+
+import pytest
+
+import db_utils
+from conftest import BENCH_EXPENSES_PER_USER, END_DATE, MONTH, YEAR
+from synthetic_data import populate
+
+SHARDS = 4
+
+
+@pytest.fixture(scope="module")
+def sharded(tmp_path_factory):
+    """Swap db_utils onto a fresh database split over SHARDS shards."""
+    path = tmp_path_factory.mktemp("sharded")
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(db_utils, "conn", db_utils.init_db(str(path / "expenses.db")))
+        mp.setattr(db_utils, "SHARD_COUNT", SHARDS)
+        mp.setattr(db_utils, "SHARD_DIR", str(path / "shards"))
+        mp.setattr(db_utils, "_shard_conns", {})
+        user_ids = populate(db_utils.conn, 20, BENCH_EXPENSES_PER_USER, end_date=END_DATE)
+        db_utils.rebalance_shards()
+        yield user_ids
+
+
+def test_init_shard(bench, sharded):
+    bench(lambda: db_utils.init_shard(db_utils.shard_path(0), 0).close())
+
+
+def test_shard_path(bench, sharded):
+    bench(db_utils.shard_path, 3)
+
+
+def test_get_shard_conn(bench, sharded):
+    bench(db_utils.get_shard_conn, 1)
+
+
+def test_home_shard(bench, sharded):
+    bench(db_utils.home_shard, sharded[0])
+
+
+def test_shard_for_user(bench, sharded):
+    bench(db_utils.shard_for_user, sharded[0])
+
+
+def test_sharded_add_expense(bench, sharded):
+    bench(db_utils.add_expense, sharded[-1], 12.5, "Food", "lunch", "2025-12-15", rounds=200)
+
+
+def test_sharded_list_expenses_month(bench, sharded):
+    bench(db_utils.list_expenses, sharded[0], *MONTH)
+
+
+def test_sharded_analytics(bench, sharded):
+    bench(db_utils.get_expense_analytics, sharded[0], *YEAR)
+
+
+def test_sharded_admin_expense_summary(bench, sharded):
+    bench(db_utils.admin_expense_summary, *YEAR)
+
+
+def test_move_user_expenses(bench, sharded):
+    targets = itertools.cycle(range(SHARDS))
+    bench(db_utils.move_user_expenses, setup=lambda: ((sharded[1], next(targets)), {}), rounds=8)
+
+
+def test_rebalance_shards(bench, sharded):
+    bench(db_utils.rebalance_shards)
+
+
+def _rows(exclude=None):
+    """Every expense row across the main database and the shards, sorted."""
+    return sorted(
+        row
+        for _, db in db_utils._all_expense_conns()
+        for row in db.execute("SELECT id, user_id, amount, date FROM expenses WHERE user_id IS NOT ?", (exclude,))
+    )
+
+
+def test_move_round_trip_keeps_other_users(bench, sharded):
+    # Move a user from the highest shard down to shard 0 and back: the copies
+    # must not make shard 0 hand out ids from the other shard's range
+    user_id = max(sharded, key=db_utils.shard_for_user)
+    home = db_utils.shard_for_user(user_id)
+    # Ids from the home shard's own range (the synthetic rows came from main)
+    for _ in range(3):
+        db_utils.add_expense(user_id, 9.5, "Transport", "bus", "2025-12-30")
+    others = _rows(exclude=user_id)
+    mine = _rows()
+
+    def round_trip():
+        db_utils.move_user_expenses(user_id, 0)
+        db_utils.move_user_expenses(user_id, home)
+    bench(round_trip)
+    assert _rows(exclude=user_id) == others
+    assert _rows() == mine
+
+    # New expenses get ids from their own shard's range, never used elsewhere
+    for uid in sharded:
+        expense_id = db_utils.add_expense(uid, 1.0, "Food", None, "2025-12-31")
+        assert expense_id // db_utils.SHARD_ID_STRIDE == db_utils.shard_for_user(uid) + 1
+    ids = [row[0] for row in _rows()]
+    assert len(ids) == len(set(ids))
+
+    # Moving every user away and back leaves every row in place
+    everything = _rows()
+    for uid in sharded:
+        shard = db_utils.shard_for_user(uid)
+        assert db_utils.move_user_expenses(uid, (shard + 1) % SHARDS)["ok"]
+        assert db_utils.move_user_expenses(uid, shard)["ok"]
+    assert _rows() == everything
@@ -1,9 +1,31 @@
 # db_utils.py
+import os
 import sqlite3
+import threading
+import zlib
+from contextlib import contextmanager
 from datetime import date
 import bcrypt
 import statistics
+from utils.metrics import get_logger, query_timer, record_cache, timed
 
+logger = get_logger(__name__)
+
+# Main database file; override with EXPENSE_DB_PATH (benchmarks use a scratch copy)
+DB_PATH = os.getenv("EXPENSE_DB_PATH", "expenses.db")
+
+# Optional sharding of the expenses table. With EXPENSE_SHARDS unset (or 0)
+# everything lives in the main database, exactly as before. With N > 0 each
+# user's expenses are routed to one of N SQLite files under EXPENSE_SHARD_DIR,
+# so writes from different users no longer contend on a single write lock.
+# Users and shard assignments always stay in the main database.
+SHARD_COUNT = int(os.getenv("EXPENSE_SHARDS", "0"))
+SHARD_DIR = os.getenv("EXPENSE_SHARD_DIR", "dbs")
+# Each shard hands out expense ids from its own range so rows keep their id
+# when they are moved between shards. SQLite would continue after the largest
+# id in the table, which may be a moved row from another range, so
+# add_expense takes the next id from the shard's sqlite_sequence instead.
+SHARD_ID_STRIDE = 10**12
 
 
 def init_db(db_path="expenses.db"):
@@ -12,6 +34,8 @@ def init_db(db_path="expenses.db"):
     cur = conn.cursor()
     # Enable foreign key support
     cur.execute("PRAGMA foreign_keys = ON;")
+    # WAL lets readers, including online backups, run alongside the writer
+    cur.execute("PRAGMA journal_mode = WAL;")
 
     cur.executescript("""
     -- Table for user accounts
@@ -40,31 +64,189 @@ def init_db(db_path="expenses.db"):
     CREATE INDEX IF NOT EXISTS idx_expenses_date ON expenses(date);
     CREATE INDEX IF NOT EXISTS idx_expenses_user_id ON expenses(user_id);
     CREATE INDEX IF NOT EXISTS idx_expenses_category ON expenses(category);
+    CREATE INDEX IF NOT EXISTS idx_expenses_updated_at ON expenses(updated_at);
+
+    -- Deleted expense ids, for incremental backups (see backup.py)
+    CREATE TABLE IF NOT EXISTS expense_deletions (
+        expense_id INTEGER NOT NULL,
+        user_id INTEGER,
+        deleted_at TEXT DEFAULT (DATETIME('now'))
+    );
+    CREATE INDEX IF NOT EXISTS idx_expense_deletions_deleted_at ON expense_deletions(deleted_at);
+    CREATE TRIGGER IF NOT EXISTS log_expense_deletion AFTER DELETE ON expenses
+    BEGIN
+        INSERT INTO expense_deletions (expense_id, user_id) VALUES (OLD.id, OLD.user_id);
+    END;
+
+    -- Rows committed by each import job, written in the same transaction as
+    -- the rows themselves so a requeued job can resume (see jobs.py)
+    CREATE TABLE IF NOT EXISTS import_checkpoints (
+        job_id INTEGER PRIMARY KEY,
+        rows INTEGER NOT NULL
+    );
+
+    -- Users pinned to a shard other than their hashed home shard
+    CREATE TABLE IF NOT EXISTS shard_assignments (
+        user_id INTEGER PRIMARY KEY,
+        shard INTEGER NOT NULL
+    );
     """)
     conn.commit()
     return conn
 
+def init_shard(db_path, shard_index):
+    """Initialize a shard database holding only the expenses table.
+
+    Shards have no users table, so there is no foreign key on user_id; the
+    main database remains the source of truth for accounts.
+    """
+    shard_conn = sqlite3.connect(db_path, check_same_thread=False)
+    cur = shard_conn.cursor()
+    cur.execute("PRAGMA journal_mode = WAL;")
+    cur.executescript("""
+    CREATE TABLE IF NOT EXISTS expenses (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        amount REAL NOT NULL,
+        category TEXT NOT NULL,
+        note TEXT,
+        date TEXT NOT NULL,
+        created_at TEXT DEFAULT (DATETIME('now')),
+        updated_at TEXT DEFAULT (DATETIME('now'))
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_expenses_date ON expenses(date);
+    CREATE INDEX IF NOT EXISTS idx_expenses_user_id ON expenses(user_id);
+    CREATE INDEX IF NOT EXISTS idx_expenses_category ON expenses(category);
+    CREATE INDEX IF NOT EXISTS idx_expenses_updated_at ON expenses(updated_at);
+
+    CREATE TABLE IF NOT EXISTS expense_deletions (
+        expense_id INTEGER NOT NULL,
+        user_id INTEGER,
+        deleted_at TEXT DEFAULT (DATETIME('now'))
+    );
+    CREATE INDEX IF NOT EXISTS idx_expense_deletions_deleted_at ON expense_deletions(deleted_at);
+    CREATE TRIGGER IF NOT EXISTS log_expense_deletion AFTER DELETE ON expenses
+    BEGIN
+        INSERT INTO expense_deletions (expense_id, user_id) VALUES (OLD.id, OLD.user_id);
+    END;
+
+    CREATE TABLE IF NOT EXISTS import_checkpoints (
+        job_id INTEGER PRIMARY KEY,
+        rows INTEGER NOT NULL
+    );
+    """)
+    # Start this shard's ids at its own offset (only on first creation)
+    cur.execute(
+        """
+        INSERT INTO sqlite_sequence (name, seq)
+        SELECT 'expenses', ?
+        WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'expenses')
+        """,
+        ((shard_index + 1) * SHARD_ID_STRIDE,)
+    )
+    shard_conn.commit()
+    return shard_conn
+
 def hash_password(password: str) -> str:
     """Hash a password for storage."""
     byte = password.encode('utf-8')
-    hashed = bcrypt.hashpw(byte, bcrypt.gensalt())
+    with timed("bcrypt_duration_seconds", op="hash"):
+        hashed = bcrypt.hashpw(byte, bcrypt.gensalt())
     return hashed.decode('utf-8')
 
 def verify_password(password: str, hashed: str) -> bool:
     """Check if a plaintext password matches the stored hash."""
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+    with timed("bcrypt_duration_seconds", op="verify"):
+        return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+conn = init_db(DB_PATH)
+
+# Open shard connections, keyed by shard index
+_shard_conns = {}
+
+def shard_path(shard_index):
+    """Return the file path of a shard database."""
+    return os.path.join(SHARD_DIR, f"expenses_{shard_index}.db")
+
+def get_shard_conn(shard_index):
+    """Return the (cached) connection for a shard, creating the file if needed."""
+    record_cache("shard_conn", shard_index in _shard_conns)
+    if shard_index not in _shard_conns:
+        os.makedirs(SHARD_DIR, exist_ok=True)
+        _shard_conns[shard_index] = init_shard(shard_path(shard_index), shard_index)
+    return _shard_conns[shard_index]
 
-conn = init_db("expenses.db")
+def home_shard(user_id):
+    """Stable hash of user_id onto a shard index."""
+    return zlib.crc32(str(user_id).encode("utf-8")) % SHARD_COUNT
+
+def shard_for_user(user_id):
+    """Return the shard a user's expenses live on (pinned shard or home shard)."""
+    row = conn.execute("SELECT shard FROM shard_assignments WHERE user_id = ?", (user_id,)).fetchone()
+    if row and row[0] < SHARD_COUNT:
+        return row[0]
+    return home_shard(user_id)
+
+def _expense_conn(user_id):
+    """Connection holding the expenses of the given user."""
+    if not SHARD_COUNT:
+        return conn
+    return get_shard_conn(shard_for_user(user_id))
+
+# Set while batch() holds an open transaction on this thread
+_batch = threading.local()
+
+def in_batch():
+    """True while batch() holds an open transaction on this thread."""
+    return getattr(_batch, "active", False)
+
+def _commit(db):
+    """Commit, unless a batch() transaction is open on this thread."""
+    if not in_batch():
+        db.commit()
+
+@contextmanager
+def batch(user_id):
+    """Run several expense operations for one user in a single transaction.
+
+    add_expense, update_expense and delete_expense skip their own commit
+    inside the block; everything is committed once at the end, or rolled
+    back if the block raises.
+    """
+    db = _expense_conn(user_id)
+    _batch.active = True
+    try:
+        yield
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    finally:
+        _batch.active = False
+
+def _all_expense_conns():
+    """Yield (label, connection) for every database that may hold expenses.
+
+    The main database is included in sharded mode too, since it still holds
+    any rows written before sharding was enabled until they are rebalanced.
+    """
+    yield "main", conn
+    for i in range(SHARD_COUNT):
+        yield f"shard{i}", get_shard_conn(i)
 
 def register_user(name, email, password):
     """Register a new user."""
     try:
         cur = conn.cursor()
-        cur.execute(
-            "INSERT INTO users (name, email, password) VALUES (?, ?, ?)",
-            (name, email, hash_password(password))
-        )
-        conn.commit()
+        hashed = hash_password(password)
+        with query_timer("register_user") as q:
+            cur.execute(
+                "INSERT INTO users (name, email, password) VALUES (?, ?, ?)",
+                (name, email, hashed)
+            )
+            conn.commit()
+            q.rows = cur.rowcount
         return {"ok": True, "message": "User registered successfully."}
     except sqlite3.IntegrityError:
         return {"ok": False, "message": "Email already exists."}
@@ -72,15 +254,17 @@ def register_user(name, email, password):
 def login_user(email, password):
     """Authenticate a user by email and password."""
     cur = conn.cursor()
-    cur.execute("SELECT id, name, email, password FROM users WHERE email = ?", (email,))
-    user = cur.fetchone()
-    print('login user:', user)
+    with query_timer("login_user") as q:
+        cur.execute("SELECT id, name, email, password FROM users WHERE email = ?", (email,))
+        user = cur.fetchone()
+        q.rows = 1 if user else 0
     if not user:
+        logger.info("login failed: user not found")
         return {"ok": False, "message": "User not found."}
     if not verify_password(password, user[3]):
-        print('user[password]',user[3])
-        print('hashed password',hash_password(password))
+        logger.info("login failed: incorrect password")
         return {"ok": False, "message": "Incorrect password."}
+    logger.info("login succeeded")
     return {"ok": True, "user": {"id": user[0], "name": user[1], "email": user[2]}}
 
 def add_expense(user_id, amount, category, note=None, date_str=None):
@@ -88,21 +272,23 @@ def add_expense(user_id, amount, category, note=None, date_str=None):
     if date_str is None:
         date_str = date.today().isoformat()
 
-    cur = conn.cursor()
-    cur.execute(
-        """
-        INSERT INTO expenses (user_id, amount, category, note, date)
-        VALUES (?, ?, ?, ?, ?)
-        """,
-        (user_id, amount, category, note, date_str)
-    )
-    conn.commit()
+    cur = _expense_conn(user_id).cursor()
+    with query_timer("add_expense") as q:
+        cur.execute(
+            """
+            INSERT INTO expenses (id, user_id, amount, category, note, date)
+            VALUES ((SELECT seq + 1 FROM sqlite_sequence WHERE name = 'expenses'), ?, ?, ?, ?, ?)
+            """,
+            (user_id, amount, category, note, date_str)
+        )
+        _commit(cur.connection)
+        q.rows = cur.rowcount
     return cur.lastrowid
 
 
 def list_expenses(user_id, start_date=None, end_date=None):
     """Retrieve all expenses for a specific user between dates."""
-    cur = conn.cursor()
+    cur = _expense_conn(user_id).cursor()
 
     query = """
         SELECT id, amount, category, note, date
@@ -122,28 +308,33 @@ def list_expenses(user_id, start_date=None, end_date=None):
         params.append(end_date)
 
     query += " ORDER BY date"
-    cur.execute(query, params)
-
-    rows = cur.fetchall()
+    with query_timer("list_expenses") as q:
+        cur.execute(query, params)
+        rows = cur.fetchall()
+        q.rows = len(rows)
     return [dict(zip(["id", "amount", "category", "note", "date"], row)) for row in rows]
 
 def delete_expense(user_id, expense_id):
     """Delete an expense if it belongs to the user."""
-    cur = conn.cursor()
+    cur = _expense_conn(user_id).cursor()
     
     # First check if the expense exists and belongs to the user
-    cur.execute(
-        "SELECT id, amount, category FROM expenses WHERE id = ? AND user_id = ?",
-        (expense_id, user_id)
-    )
-    expense = cur.fetchone()
+    with query_timer("delete_expense_lookup") as q:
+        cur.execute(
+            "SELECT id, amount, category FROM expenses WHERE id = ? AND user_id = ?",
+            (expense_id, user_id)
+        )
+        expense = cur.fetchone()
+        q.rows = 1 if expense else 0
     
     if not expense:
         return {"ok": False, "message": f"Expense {expense_id} not found or does not belong to you."}
     
     # Delete the expense
-    cur.execute("DELETE FROM expenses WHERE id = ? AND user_id = ?", (expense_id, user_id))
-    conn.commit()
+    with query_timer("delete_expense") as q:
+        cur.execute("DELETE FROM expenses WHERE id = ? AND user_id = ?", (expense_id, user_id))
+        _commit(cur.connection)
+        q.rows = cur.rowcount
     
     return {
         "ok": True, 
@@ -153,14 +344,16 @@ def delete_expense(user_id, expense_id):
 
 def update_expense(user_id, expense_id, amount=None, category=None, note=None, date_str=None):
     """Update an expense if it belongs to the user."""
-    cur = conn.cursor()
+    cur = _expense_conn(user_id).cursor()
     
     # First check if the expense exists and belongs to the user
-    cur.execute(
-        "SELECT id FROM expenses WHERE id = ? AND user_id = ?",
-        (expense_id, user_id)
-    )
-    expense = cur.fetchone()
+    with query_timer("update_expense_lookup") as q:
+        cur.execute(
+            "SELECT id FROM expenses WHERE id = ? AND user_id = ?",
+            (expense_id, user_id)
+        )
+        expense = cur.fetchone()
+        q.rows = 1 if expense else 0
     
     if not expense:
         return {"ok": False, "message": f"Expense {expense_id} not found or does not belong to you."}
@@ -189,16 +382,40 @@ def update_expense(user_id, expense_id, amount=None, category=None, note=None, d
     params.extend([expense_id, user_id])
     
     query = f"UPDATE expenses SET {', '.join(updates)} WHERE id = ? AND user_id = ?"
-    cur.execute(query, params)
-    conn.commit()
+    with query_timer("update_expense") as q:
+        cur.execute(query, params)
+        _commit(cur.connection)
+        q.rows = cur.rowcount
     
     return {"ok": True, "message": f"Successfully updated expense #{expense_id}"}
 
 
+def get_import_checkpoint(user_id, job_id):
+    """Number of rows an import job has committed for the user so far."""
+    row = _expense_conn(user_id).execute(
+        "SELECT rows FROM import_checkpoints WHERE job_id = ?", (job_id,)
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def save_import_checkpoint(user_id, job_id, rows):
+    """Record that an import job has committed `rows` rows; inside batch() it commits with them."""
+    db = _expense_conn(user_id)
+    db.execute("INSERT OR REPLACE INTO import_checkpoints (job_id, rows) VALUES (?, ?)", (job_id, rows))
+    _commit(db)
+
+
+def clear_import_checkpoints(job_ids):
+    """Forget the checkpoints of purged jobs."""
+    for _, db in _all_expense_conns():
+        with db:
+            db.executemany("DELETE FROM import_checkpoints WHERE job_id = ?", [(job_id,) for job_id in job_ids])
+
+
 def get_expense_analytics(user_id, start_date=None, end_date=None, group_by="category"):
-    print('get_expense_analytics called with:', user_id, start_date, end_date, group_by)
     """Get detailed analytics for user expenses."""
-    cur = conn.cursor()
+    logger.debug("get_expense_analytics(%s, %s, %s, %s)", user_id, start_date, end_date, group_by)
+    cur = _expense_conn(user_id).cursor()
     
     # Get all expenses in the date range
     query = "SELECT amount, category, date FROM expenses WHERE user_id = ?"
@@ -214,8 +431,10 @@ def get_expense_analytics(user_id, start_date=None, end_date=None, group_by="cat
         query += " AND date <= ?"
         params.append(end_date)
     
-    cur.execute(query, params)
-    expenses = cur.fetchall()
+    with query_timer("get_expense_analytics") as q:
+        cur.execute(query, params)
+        expenses = cur.fetchall()
+        q.rows = len(expenses)
     
     if not expenses:
         return {
@@ -272,3 +491,172 @@ def get_expense_analytics(user_id, start_date=None, end_date=None, group_by="cat
         "message": f"Analysis complete: {len(expenses)} expenses, ${total:.2f} total, ${mean:.2f} average"
     }
 
+
+def admin_expense_summary(start_date=None, end_date=None):
+    """Aggregate expense totals across all users and shards (admin use only)."""
+    where = ""
+    params = []
+
+    if start_date and end_date:
+        where = " WHERE date BETWEEN ? AND ?"
+        params += [start_date, end_date]
+    elif start_date:
+        where = " WHERE date >= ?"
+        params.append(start_date)
+    elif end_date:
+        where = " WHERE date <= ?"
+        params.append(end_date)
+
+    query = f"SELECT category, COUNT(*), SUM(amount) FROM expenses{where} GROUP BY category"
+
+    shards = []
+    by_category = {}
+    for label, shard_conn in _all_expense_conns():
+        rows = shard_conn.execute(query, params).fetchall()
+        users = shard_conn.execute(f"SELECT COUNT(DISTINCT user_id) FROM expenses{where}", params).fetchone()[0]
+        count = sum(row[1] for row in rows)
+        total = sum(row[2] for row in rows)
+        for category, _, amount in rows:
+            by_category[category] = by_category.get(category, 0) + amount
+        shards.append({"shard": label, "users": users, "count": count, "total": round(total, 2)})
+
+    count = sum(shard["count"] for shard in shards)
+    total = sum(shard["total"] for shard in shards)
+    return {
+        "ok": True,
+        "count": count,
+        "total": round(total, 2),
+        "by_category": {k: round(v, 2) for k, v in sorted(by_category.items(), key=lambda x: x[1], reverse=True)},
+        "shards": shards,
+        "message": f"{count} expenses, ${total:.2f} total across {len(shards)} database(s)"
+    }
+
+
+def _foreign_ids(db, user_id, ids):
+    """Return the ids among `ids` that belong to another user on db."""
+    taken = []
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        taken += [row[0] for row in db.execute(
+            f"SELECT id FROM expenses WHERE user_id != ? AND id IN ({', '.join('?' * len(chunk))})",
+            [user_id, *chunk]
+        )]
+    return taken
+
+
+def move_user_expenses(user_id, target_shard):
+    """Move all of a user's expenses onto target_shard and route the user there.
+
+    Rows are copied (keeping their ids) before they are deleted from the
+    source, so an interrupted move can simply be run again. Nothing is moved
+    if one of the ids is used by another user on the target. Run it while
+    the user is not writing.
+    """
+    if not SHARD_COUNT:
+        return {"ok": False, "message": "Sharding is not enabled (set EXPENSE_SHARDS)."}
+    if not 0 <= target_shard < SHARD_COUNT:
+        return {"ok": False, "message": f"Shard {target_shard} does not exist (0-{SHARD_COUNT - 1})."}
+
+    dest = get_shard_conn(target_shard)
+    columns = "id, user_id, amount, category, note, date, created_at, updated_at"
+    sources = []
+    for _, src in _all_expense_conns():
+        if src is dest:
+            continue
+        rows = src.execute(f"SELECT {columns} FROM expenses WHERE user_id = ?", (user_id,)).fetchall()
+        if rows:
+            sources.append((src, rows))
+
+    clashes = _foreign_ids(dest, user_id, [row[0] for _, rows in sources for row in rows])
+    if clashes:
+        return {"ok": False, "moved": 0,
+                "message": f"Expense id(s) {clashes[:5]} are used by another user on shard {target_shard}; nothing moved."}
+
+    # Copy every stray row onto the target shard. Only the user's own earlier
+    # copies can be replaced, which makes a rerun after an interruption safe.
+    moved = 0
+    for src, rows in sources:
+        with dest:
+            seq = dest.execute("SELECT seq FROM sqlite_sequence WHERE name = 'expenses'").fetchone()
+            dest.executemany(f"INSERT OR REPLACE INTO expenses ({columns}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            # Copied ids from other ranges must not move the target's own id counter
+            if seq:
+                dest.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'expenses'", seq)
+            # Mark the copies as changed so incremental backups of the target pick them up
+            dest.execute("UPDATE expenses SET updated_at = DATETIME('now') WHERE user_id = ?", (user_id,))
+        moved += len(rows)
+
+    # Route the user to the target shard before removing the old copies
+    with conn:
+        if target_shard == home_shard(user_id):
+            conn.execute("DELETE FROM shard_assignments WHERE user_id = ?", (user_id,))
+        else:
+            conn.execute(
+                "INSERT OR REPLACE INTO shard_assignments (user_id, shard) VALUES (?, ?)",
+                (user_id, target_shard)
+            )
+
+    for src, _ in sources:
+        with src:
+            src.execute("DELETE FROM expenses WHERE user_id = ?", (user_id,))
+
+    return {"ok": True, "moved": moved, "message": f"Moved {moved} expense(s) of user {user_id} to shard {target_shard}"}
+
+
+def rebalance_shards():
+    """Move every user whose expenses sit outside their assigned shard.
+
+    Use after enabling sharding on an existing database or after changing
+    EXPENSE_SHARDS.
+    """
+    if not SHARD_COUNT:
+        return {"ok": False, "message": "Sharding is not enabled (set EXPENSE_SHARDS)."}
+
+    misplaced = set()
+    for label, shard_conn in _all_expense_conns():
+        for (user_id,) in shard_conn.execute("SELECT DISTINCT user_id FROM expenses"):
+            if label != f"shard{shard_for_user(user_id)}":
+                misplaced.add(user_id)
+
+    moved = 0
+    failed = []
+    for user_id in sorted(misplaced):
+        result = move_user_expenses(user_id, shard_for_user(user_id))
+        moved += result["moved"]
+        if not result["ok"]:
+            failed.append({"user_id": user_id, "message": result["message"]})
+
+    message = f"Rebalanced {len(misplaced) - len(failed)} user(s), moved {moved} expense(s)"
+    if failed:
+        message += f"; {len(failed)} user(s) could not be moved"
+    return {
+        "ok": not failed,
+        "users": len(misplaced),
+        "moved": moved,
+        "failed": failed,
+        "message": message
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Expense database admin tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    summary = sub.add_parser("summary", help="aggregate expenses across all shards")
+    summary.add_argument("--start-date")
+    summary.add_argument("--end-date")
+    sub.add_parser("rebalance", help="move misplaced users onto their shard")
+    move = sub.add_parser("move", help="move one user's expenses to a shard")
+    move.add_argument("user_id", type=int)
+    move.add_argument("shard", type=int)
+    args = parser.parse_args()
+
+    if args.command == "summary":
+        result = admin_expense_summary(args.start_date, args.end_date)
+    elif args.command == "rebalance":
+        result = rebalance_shards()
+    else:
+        result = move_user_expenses(args.user_id, args.shard)
+    print(json.dumps(result, indent=2))
@@ -6,23 +6,27 @@ from fastmcp import Client as FastMCPClient
 from datetime import date,datetime
 from dotenv import load_dotenv
 from db_utils import register_user, login_user
+from jobs import list_jobs
 import os
 from utils.voice_models import speech_to_text, text_to_speech, speech_to_text2
+from utils.query_cache import QueryCache, extract_tool_plan, render_tool_result
+from utils.model_gateway import get_gateway
+from utils.tool_loop import gemini_tools, run_tool_loop
 from streamlit_mic_recorder import mic_recorder
 
 
 load_dotenv()  # Load environment variables from .env file
 
-gemini_api_key = os.getenv("gemini_api_key")
-
-# Gemini client setup
-gemini_client = genai.Client(api_key=gemini_api_key)
+# All Gemini calls go through the shared gateway (rate limits, retries, deadlines)
+gateway = get_gateway()
 
 # session management
 if "user" not in st.session_state:
     st.session_state.user = None
 if "messages" not in st.session_state:
     st.session_state.messages = []
+if "query_cache" not in st.session_state:
+    st.session_state.query_cache = QueryCache()
 
 # ------------------ Authentication UI ------------------
 def register_popup():
@@ -59,6 +63,24 @@ def login_popup():
             else:
                 st.error(res["message"])
 
+# ------------------ Background Jobs ------------------
+
+@st.fragment(run_every=3)
+def jobs_panel():
+    """Recent background jobs; reruns on its own every few seconds to poll for completion."""
+    recent = list_jobs(st.session_state.user['id'], limit=5)
+    if not recent:
+        st.caption("No background jobs yet.")
+        return
+    for job in recent:
+        label = f"#{job['id']} {job['kind']} · {job['status']}"
+        if job["status"] in ("queued", "running"):
+            st.progress(job["progress"], text=label)
+        else:
+            st.write(label)
+        if job["message"]:
+            st.caption(job["message"])
+
 # ------------------ Chat Interface ------------------
 
 # MCP HTTP client
@@ -91,35 +113,75 @@ def extract_text_from_response(response):
         return "(Error extracting response)"
 
 
+async def replay_plan(plan):
+    """Run a cached tool plan directly against the MCP server, without the model."""
+    async with mcp_client:
+        parts = []
+        for name, args in plan:
+            result = await mcp_client.call_tool(name, args)
+            parts.append(render_tool_result(name, result.data))
+        return "\n\n".join(parts)
+
+
+async def call_tool(name, args):
+    """Run one tool call the model asked for on the MCP server; the result goes back to the model."""
+    result = await mcp_client.call_tool(name, args, raise_on_error=False)
+    if result.is_error:
+        return {"error": "\n".join(getattr(part, "text", "") for part in result.content)}
+    return {"result": result.data}
+
+
 async def run_query(prompt: str):
-    """Run a query through Gemini with MCP tools."""
+    """Run a query through Gemini with MCP tools; return (final response, turn history)."""
     try:
         async with mcp_client:
             today_str = date.today().isoformat()
             user_id = st.session_state.user['id']
             
-            response = await gemini_client.aio.models.generate_content(
+            # Tools run here, each exactly once, rather than inside generate_content, so
+            # every model round trip can be retried and hedged without repeating a write
+            return await run_tool_loop(
+                gateway,
+                call_tool,
+                prompt,
+                # The same prompt submitted twice while the first is in flight gets one
+                # first answer; each submission still runs its own tool calls
+                coalesce_key=(user_id, today_str, prompt),
+                label="chat",
                 model="gemini-2.5-flash",  # Using the latest model
-                contents=prompt,
                 config=genai.types.GenerateContentConfig(
                     temperature=0,
-                    tools=[mcp_client.session],
+                    tools=gemini_tools(await mcp_client.list_tools()),
+                    automatic_function_calling=types.AutomaticFunctionCallingConfig(disable=True),
                     system_instruction=(
                         "You are a multi user expense tracker assistant. "
                         f"Today's date is {today_str}. "
-                        f"The current user has user_id={user_id}. ALWAYS use this user_id when calling add_expense or list_expenses tools. "
+                        f"The current user has user_id={user_id}. ALWAYS use this user_id when calling any tool. "
                         "\n\nAvailable Operations:"
                         "\n1. ADD EXPENSE: Use add_expense(user_id, amount, category, note, date)"
                         "\n2. LIST EXPENSES: Use list_expenses(user_id, start_date, end_date)"
                         "\n   - Returns list of expenses with id, amount, category, note, date, if no date range is mentioned list all of the expenses"
                         "\n   - Use this to answer questions about specific categories"
+                        "\n   - Pass compact=true when many expenses are expected (e.g. all expenses, a whole year): rows follow 'columns' and category is an index into 'categories'"
                         "\n   - You can filter and calculate totals from the results"
                         "\n3. DELETE EXPENSE: Use delete_expense(user_id, expense_id) - Ask user to list expenses first to get the ID"
                         "\n4. EDIT EXPENSE: Use edit_expense(user_id, expense_id, amount, category, note, date) - Only update provided fields"
                         "\n5. ANALYZE EXPENSES: Use get_expense_analysis(user_id, start_date, end_date, group_by)"
                         "\n   - group_by: 'category' (default), 'date', or 'month'"
                         "\n   - Returns mean, median, total, min, max, std_dev, and grouped data"
+                        "\n   - Pass compact=true with group_by='date' or long periods: grouped data comes as 'groups' [key, amount] pairs"
                         "\n   - Use for general analytics, not category-specific queries"
+                        "\n6. BATCH: Use execute_batch(user_id, operations) when a message asks for MORE THAN ONE operation"
+                        "\n   - operations is a list of dicts with 'op' ('add', 'edit', 'delete', 'list', 'analyze') and that tool's arguments"
+                        "\n   - Example: 'add 50 for uber, 200 for groceries and delete #5' → execute_batch(user_id, ["
+                        "{'op': 'add', 'amount': 50, 'category': 'Transport', 'note': 'uber'}, "
+                        "{'op': 'add', 'amount': 200, 'category': 'Groceries', 'note': 'groceries'}, "
+                        "{'op': 'delete', 'expense_id': 5}])"
+                        "\n   - Runs everything in one call; report each operation's result from 'results'"
+                        "\n7. BACKGROUND JOBS: Use submit_job(user_id, kind, ...) for long operations on the whole history:"
+                        "\n   - kind='analysis' (full-history analysis), 'export' (CSV export), 'recategorize' (recategorize all expenses), 'import' (bulk import of rows)"
+                        "\n   - submit_job returns immediately with a job_id; tell the user the job is running and shows up in the sidebar"
+                        "\n   - Use job_status(user_id, job_id) to check progress, job_result(user_id, job_id) to fetch a finished result, cancel_job(user_id, job_id) to cancel"
                         "\n\nCATEGORY INFERENCE (VERY IMPORTANT):"
                         "\nYou MUST intelligently infer the category from the user's description. NEVER ask for category."
                         "\nUse these standard categories and map user descriptions to them:"
@@ -159,13 +221,13 @@ async def run_query(prompt: str):
                         "\n- When showing expense lists, format them nicely with ID, amount, category, note, and date in table form compulsory"
                         "\n- Be conversational and helpful, explaining the results clearly"
                         "\n- Note: If no date is provided, use today's date with format YYYY-MM-DD. "
+                        "\n- For multi-intent messages, ALWAYS use a single execute_batch call instead of several separate tool calls"
                         "\n- NEVER ask unnecessary clarifying questions - be proactive and intelligent"
                         "Provide clear, concise responses. After calling a tool, summarize the result for the user."
                         
                     ),
                 ),
             )
-            return response
     except Exception as e:
         print(f"Error in run_query: {e}")
         raise e
@@ -212,8 +274,17 @@ else:
         - "What's my average spending?"
         - "Analyze my expenses by month"
         - "Show spending trends"
+
+        **Background Jobs:**
+        - "Export all my expenses"
+        - "Recategorize all my expenses"
+        - "Analyze my full history in the background"
         """)
         
+        st.divider()
+        st.subheader("⏳ Background Jobs")
+        jobs_panel()
+
         st.divider()
         if st.button("🚪 Logout", use_container_width=True):
             st.session_state.user = None
@@ -278,8 +349,17 @@ else:
 
         with st.spinner("Processing..."):
             try:
-                resp = asyncio.run(run_query(user_input))
-                ai_response = extract_text_from_response(resp)
+                # Repeated intents replay their cached tool plan and skip Gemini
+                cache = st.session_state.query_cache
+                user_id = st.session_state.user['id']
+                cache_key = cache.key(user_id, user_input, date.today().isoformat())
+                plan = cache.get(cache_key)
+                if plan:
+                    ai_response = asyncio.run(replay_plan(plan))
+                else:
+                    resp, history = asyncio.run(run_query(user_input))
+                    ai_response = extract_text_from_response(resp)
+                    cache.record(cache_key, user_id, extract_tool_plan(history))
 
                 st.session_state.messages.append({"role": "assistant", "content": ai_response})
                 
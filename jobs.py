@@ -0,0 +1,402 @@
+# jobs.py
+"""Background jobs for expensive operations.
+
+Jobs are rows in a `jobs` table of the main database. A pool of worker
+processes claims queued jobs, runs them and stores their JSON result, so
+full-history analysis, exports, recategorization and bulk imports never
+run inside an MCP tool call or a Streamlit rerun.
+
+    python jobs.py --workers 2        # run a worker pool on its own
+
+main.py starts a pool next to the MCP server.
+"""
+import csv
+import json
+import multiprocessing
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import db_utils
+from utils.metrics import get_logger
+
+logger = get_logger(__name__)
+
+JOB_KINDS = ("analysis", "export", "recategorize", "import")
+JOB_WORKERS = int(os.getenv("EXPENSE_JOB_WORKERS", "2"))
+# Finished jobs (and their export files) are purged after this many days
+JOB_RETENTION_DAYS = int(os.getenv("EXPENSE_JOB_RETENTION_DAYS", "7"))
+EXPORT_DIR = os.getenv("EXPENSE_EXPORT_DIR", "exports")
+# Rows handled between progress updates and cancellation checks
+CHUNK_SIZE = 500
+POLL_INTERVAL = 1.0
+# Workers refresh the heartbeat of their running job this often; a running job
+# whose heartbeat is older than the lease belongs to a dead pool and is requeued
+HEARTBEAT_INTERVAL = 10
+JOB_LEASE_SECONDS = int(os.getenv("EXPENSE_JOB_LEASE_SECONDS", "60"))
+PURGE_INTERVAL = 3600
+
+# Keywords used by the recategorize job, mirroring the chat assistant's rules
+CATEGORY_KEYWORDS = {
+    "Food": ["dinner", "lunch", "breakfast", "snack", "meal", "restaurant", "cafe", "coffee", "pizza", "burger"],
+    "Groceries": ["grocer", "supermarket", "vegetable", "fruit", "meat", "dairy"],
+    "Transport": ["uber", "taxi", "bus", "train", "metro", "fuel", "petrol", "parking", "ride"],
+    "Travel": ["flight", "hotel", "vacation", "trip", "airbnb", "booking"],
+    "Entertainment": ["movie", "concert", "game", "netflix", "spotify", "music", "party"],
+    "Shopping": ["clothes", "shoes", "electronics", "gadget", "amazon"],
+    "Healthcare": ["doctor", "medicine", "pharmacy", "hospital", "clinic", "medical"],
+    "Utilities": ["electricity", "water", "gas bill", "internet", "phone bill"],
+    "Rent": ["rent", "lease", "apartment", "housing"],
+    "Education": ["book", "course", "tuition", "school", "university"],
+}
+
+
+class JobCancelled(Exception):
+    """Raised inside a handler when the job has been cancelled."""
+
+
+def init_jobs_table(db):
+    """Create the jobs table if it doesn't exist."""
+    db.executescript("""
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        params TEXT NOT NULL DEFAULT '{}',
+        status TEXT NOT NULL DEFAULT 'queued',  -- queued, running, done, failed, cancelled
+        progress REAL NOT NULL DEFAULT 0,
+        message TEXT,
+        result TEXT,
+        cancel_requested INTEGER NOT NULL DEFAULT 0,
+        worker TEXT,                            -- "<pool pid>-<n>" of the worker running it
+        heartbeat_at TEXT,
+        created_at TEXT DEFAULT (DATETIME('now')),
+        started_at TEXT,
+        finished_at TEXT
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id);
+    CREATE INDEX IF NOT EXISTS idx_jobs_user_id ON jobs(user_id);
+    """)
+    db.commit()
+
+
+conn = db_utils.conn
+init_jobs_table(conn)
+
+_JOB_COLUMNS = ["id", "kind", "status", "progress", "message", "created_at", "started_at", "finished_at"]
+
+
+def submit_job(user_id, kind, params=None):
+    """Queue a job for a user."""
+    if kind not in JOB_KINDS:
+        return {"ok": False, "message": f"Unknown job kind '{kind}'. Use one of: {', '.join(JOB_KINDS)}."}
+    if kind == "import":
+        # The same check add_expense makes, done before anything is queued
+        invalid = [i for i, row in enumerate((params or {}).get("rows", [])) if not (row.get("amount") or 0) > 0]
+        if invalid:
+            return {"ok": False, "message": f"Amount must be positive (row(s) {invalid[:5]})."}
+    with conn:
+        cur = conn.execute(
+            "INSERT INTO jobs (user_id, kind, params) VALUES (?, ?, ?)",
+            (user_id, kind, json.dumps(params or {}))
+        )
+    return {"ok": True, "job_id": cur.lastrowid, "message": f"Queued {kind} job #{cur.lastrowid}"}
+
+
+def get_job(user_id, job_id):
+    """Return status and progress of a job if it belongs to the user."""
+    row = conn.execute(
+        f"SELECT {', '.join(_JOB_COLUMNS)} FROM jobs WHERE id = ? AND user_id = ?",
+        (job_id, user_id)
+    ).fetchone()
+    if not row:
+        return {"ok": False, "message": f"Job {job_id} not found or does not belong to you."}
+    return {"ok": True, **dict(zip(_JOB_COLUMNS, row))}
+
+
+def get_job_result(user_id, job_id):
+    """Return the result of a finished job."""
+    row = conn.execute(
+        "SELECT status, message, result FROM jobs WHERE id = ? AND user_id = ?",
+        (job_id, user_id)
+    ).fetchone()
+    if not row:
+        return {"ok": False, "message": f"Job {job_id} not found or does not belong to you."}
+    status, message, result = row
+    if status != "done":
+        return {"ok": False, "status": status, "message": message or f"Job {job_id} is {status}."}
+    return {"ok": True, "status": status, "result": json.loads(result), "message": message}
+
+
+def list_jobs(user_id, limit=10):
+    """Return the user's most recent jobs, newest first."""
+    rows = conn.execute(
+        f"SELECT {', '.join(_JOB_COLUMNS)} FROM jobs WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+        (user_id, limit)
+    ).fetchall()
+    return [dict(zip(_JOB_COLUMNS, row)) for row in rows]
+
+
+def cancel_job(user_id, job_id):
+    """Cancel a queued job, or ask a running one to stop at its next checkpoint."""
+    with conn:
+        cur = conn.execute(
+            """
+            UPDATE jobs SET status = 'cancelled', finished_at = DATETIME('now'), message = 'Cancelled.'
+            WHERE id = ? AND user_id = ? AND status = 'queued'
+            """,
+            (job_id, user_id)
+        )
+        if cur.rowcount:
+            return {"ok": True, "message": f"Cancelled job #{job_id}"}
+        cur = conn.execute(
+            "UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND user_id = ? AND status = 'running'",
+            (job_id, user_id)
+        )
+    if cur.rowcount:
+        return {"ok": True, "message": f"Cancellation requested for running job #{job_id}"}
+    return {"ok": False, "message": f"Job {job_id} not found, not yours, or already finished."}
+
+
+def purge_jobs(retention_days=JOB_RETENTION_DAYS):
+    """Delete finished jobs older than retention_days, and their export files."""
+    cutoff = f"-{retention_days} days"
+    rows = conn.execute(
+        """
+        SELECT id, kind, result FROM jobs
+        WHERE status IN ('done', 'failed', 'cancelled') AND finished_at < DATETIME('now', ?)
+        """,
+        (cutoff,)
+    ).fetchall()
+    for _, kind, result in rows:
+        if kind == "export" and result:
+            path = json.loads(result).get("path")
+            if path and os.path.exists(path):
+                os.remove(path)
+    with conn:
+        conn.executemany("DELETE FROM jobs WHERE id = ?", [(row[0],) for row in rows])
+    db_utils.clear_import_checkpoints([row[0] for row in rows if row[1] == "import"])
+    return len(rows)
+
+
+def requeue_stale_jobs(lease=JOB_LEASE_SECONDS):
+    """Put jobs left 'running' by a dead pool back in the queue.
+
+    Jobs of live pools keep a fresh heartbeat, so only those whose heartbeat
+    is older than `lease` seconds are requeued.
+    """
+    with conn:
+        cur = conn.execute(
+            """
+            UPDATE jobs SET status = 'queued', started_at = NULL, worker = NULL, heartbeat_at = NULL
+            WHERE status = 'running' AND heartbeat_at < DATETIME('now', ?)
+            """,
+            (f"-{lease} seconds",)
+        )
+    return cur.rowcount
+
+
+# ------------------ Job handlers ------------------
+
+class Job:
+    """A claimed job, as seen by its handler."""
+
+    def __init__(self, job_id, user_id, kind, params):
+        self.id = job_id
+        self.user_id = user_id
+        self.kind = kind
+        self.params = params
+
+    def report(self, progress, message=None):
+        """Record progress (0-1) and raise JobCancelled if cancellation was requested."""
+        with conn:
+            conn.execute(
+                "UPDATE jobs SET progress = ?, message = COALESCE(?, message), heartbeat_at = DATETIME('now') "
+                "WHERE id = ?",
+                (round(progress, 3), message, self.id)
+            )
+        row = conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (self.id,)).fetchone()
+        if row and row[0]:
+            raise JobCancelled()
+
+
+def _run_analysis(job):
+    """Full-history analytics, grouped by category and by month."""
+    groupings = job.params.get("group_by") or ["category", "month"]
+    result = {}
+    for i, group_by in enumerate(groupings):
+        job.report(i / len(groupings), f"Analyzing by {group_by}")
+        result[group_by] = db_utils.get_expense_analytics(job.user_id, group_by=group_by)
+    return result
+
+
+def _run_export(job):
+    """Write all of the user's expenses to a CSV file."""
+    expenses = db_utils.list_expenses(job.user_id, job.params.get("start_date"), job.params.get("end_date"))
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    path = os.path.join(EXPORT_DIR, f"expenses_user{job.user_id}_job{job.id}.csv")
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["id", "amount", "category", "note", "date"])
+        writer.writeheader()
+        for start in range(0, len(expenses), CHUNK_SIZE):
+            job.report(start / len(expenses), f"Exported {start}/{len(expenses)} rows")
+            writer.writerows(expenses[start:start + CHUNK_SIZE])
+    return {"path": path, "rows": len(expenses)}
+
+
+def infer_category(note):
+    """Category suggested by the keywords in a note, or None."""
+    text = (note or "").lower()
+    for category, keywords in CATEGORY_KEYWORDS.items():
+        if any(re.search(rf"\b{re.escape(keyword)}", text) for keyword in keywords):
+            return category
+    return None
+
+
+def _run_recategorize(job):
+    """Re-derive every expense's category from its note."""
+    dry_run = job.params.get("dry_run", False)
+    expenses = db_utils.list_expenses(job.user_id)
+    changes = [
+        (exp["id"], category) for exp in expenses
+        if (category := infer_category(exp["note"])) and category != exp["category"]
+    ]
+    if not dry_run:
+        for start in range(0, len(changes), CHUNK_SIZE):
+            job.report(start / max(len(changes), 1), f"Updated {start}/{len(changes)} expenses")
+            with db_utils.batch(job.user_id):
+                for expense_id, category in changes[start:start + CHUNK_SIZE]:
+                    db_utils.update_expense(job.user_id, expense_id, category=category)
+    return {"examined": len(expenses), "changed": len(changes), "dry_run": dry_run,
+            "changes": [{"id": i, "category": c} for i, c in changes[:100]]}
+
+
+def _run_import(job):
+    """Insert a list of expenses in chunks, one transaction per chunk.
+
+    Each chunk's transaction also records how many rows are committed, so a
+    job requeued after its pool died resumes after the last committed chunk.
+    """
+    rows = job.params.get("rows", [])
+    imported = db_utils.get_import_checkpoint(job.user_id, job.id)
+    for start in range(imported, len(rows), CHUNK_SIZE):
+        job.report(start / len(rows), f"Imported {imported}/{len(rows)} expenses")
+        with db_utils.batch(job.user_id):
+            for row in rows[start:start + CHUNK_SIZE]:
+                db_utils.add_expense(job.user_id, row["amount"], row["category"], row.get("note"), row.get("date"))
+                imported += 1
+            db_utils.save_import_checkpoint(job.user_id, job.id, imported)
+    return {"imported": imported}
+
+
+_HANDLERS = {
+    "analysis": _run_analysis,
+    "export": _run_export,
+    "recategorize": _run_recategorize,
+    "import": _run_import,
+}
+
+
+def _claim_next(worker=None):
+    """Atomically mark the oldest queued job as running by `worker` and return it."""
+    with conn:
+        row = conn.execute(
+            """
+            UPDATE jobs SET status = 'running', started_at = DATETIME('now'), worker = ?,
+                heartbeat_at = DATETIME('now')
+            WHERE id = (SELECT id FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1)
+            RETURNING id, user_id, kind, params
+            """,
+            (worker,)
+        ).fetchone()
+    if not row:
+        return None
+    return Job(row[0], row[1], row[2], json.loads(row[3]))
+
+
+def _finish(job, status, message, result=None):
+    with conn:
+        conn.execute(
+            """
+            UPDATE jobs SET status = ?, message = ?, result = ?, progress = COALESCE(?, progress),
+                finished_at = DATETIME('now')
+            WHERE id = ?
+            """,
+            (status, message, json.dumps(result) if result is not None else None,
+             1 if status == "done" else None, job.id)
+        )
+
+
+def run_next(worker=None):
+    """Claim and run one queued job in this process. Returns False if the queue is empty."""
+    job = _claim_next(worker)
+    if job is None:
+        return False
+    try:
+        result = _HANDLERS[job.kind](job)
+    except JobCancelled:
+        _finish(job, "cancelled", "Cancelled while running.")
+    except Exception as e:
+        logger.warning("job %s (%s) failed: %s", job.id, job.kind, e)
+        _finish(job, "failed", f"Job failed: {str(e)}")
+    else:
+        _finish(job, "done", f"{job.kind.capitalize()} job finished.", result)
+    return True
+
+
+def _heartbeat(worker):
+    """Keep the heartbeat of the worker's running job fresh, even while a handler is busy."""
+    db = sqlite3.connect(db_utils.DB_PATH, timeout=30)
+    while True:
+        with db:
+            db.execute(
+                "UPDATE jobs SET heartbeat_at = DATETIME('now') WHERE worker = ? AND status = 'running'",
+                (worker,)
+            )
+        time.sleep(HEARTBEAT_INTERVAL)
+
+
+def _worker(worker):
+    threading.Thread(target=_heartbeat, args=(worker,), daemon=True).start()
+    last_purge = last_requeue = 0
+    while True:
+        if time.monotonic() - last_purge > PURGE_INTERVAL:
+            purge_jobs()
+            last_purge = time.monotonic()
+        # Pick up the jobs of pools that died while this one is running
+        if time.monotonic() - last_requeue > JOB_LEASE_SECONDS:
+            requeue_stale_jobs()
+            last_requeue = time.monotonic()
+        if not run_next(worker):
+            time.sleep(POLL_INTERVAL)
+
+
+def start_workers(count=JOB_WORKERS):
+    """Start `count` daemon worker processes and return them."""
+    # spawn, so workers never share the parent's SQLite connections
+    ctx = multiprocessing.get_context("spawn")
+    workers = [
+        ctx.Process(target=_worker, args=(f"{os.getpid()}-{i}",), name=f"job-worker-{i}", daemon=True)
+        for i in range(count)
+    ]
+    for worker in workers:
+        worker.start()
+    return workers
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the background job worker pool")
+    parser.add_argument("--workers", type=int, default=JOB_WORKERS)
+    args = parser.parse_args()
+
+    print(f"Starting {args.workers} job worker(s)")
+    try:
+        for worker in start_workers(args.workers):
+            worker.join()
+    except KeyboardInterrupt:
+        print("\nShutting down job workers...")
@@ -1,19 +1,41 @@
 from fastmcp import FastMCP
-from db_utils import ( init_db, add_expense as db_add, list_expenses as db_list,
+from db_utils import ( DB_PATH, init_db, add_expense as db_add, list_expenses as db_list,
                       delete_expense as db_delete,
                     update_expense as db_update,
-                        get_expense_analytics as db_analytics)
+                        get_expense_analytics as db_analytics,
+                        batch as db_batch, in_batch as db_in_batch)
 from datetime import datetime
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Literal
 import logging
+import sqlite3
+from pydantic import BaseModel
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+from utils.metrics import get_logger, instrument_tool, render_prometheus
+from utils.result_encoding import compact_analysis, compact_expenses
+import jobs
 
 # Set up logging to suppress unnecessary warnings
 logging.basicConfig(level=logging.WARNING)
 
+logger = get_logger(__name__)
+
 mcp = FastMCP(name="Expense Tracker")
-conn = init_db("expenses.db")
+conn = init_db(DB_PATH)
+
+
+@mcp.custom_route("/metrics", methods=["GET"])
+async def metrics(request: Request) -> PlainTextResponse:
+    """Expose tool, SQL, cache and bcrypt metrics in Prometheus text format."""
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+def _raise_in_batch(e):
+    """Inside execute_batch, let database errors through so the whole batch rolls back."""
+    if isinstance(e, sqlite3.Error) and db_in_batch():
+        raise e
 
 @mcp.tool()
+@instrument_tool
 def add_expense(user_id: int, amount: float, category: str, note: Optional[str] = None, date: Optional[str] = None) -> Dict:
     """Add a new expense for a user.
     
@@ -41,17 +63,27 @@ def add_expense(user_id: int, amount: float, category: str, note: Optional[str]
             "message": f"Successfully added expense: ${amount:.2f} for {category}"
         }
     except Exception as e:
+        _raise_in_batch(e)
         return {"ok": False, "message": f"Error adding expense: {str(e)}"}
 
 
 @mcp.tool()
-def list_expenses(user_id: int, start_date: Optional[str] = None, end_date: Optional[str] = None) -> Dict:
+@instrument_tool
+def list_expenses(
+    user_id: int,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    compact: Optional[bool] = False
+) -> Dict:
     """List expenses for a specific user between two dates.
     
     Args:
         user_id: The ID of the user whose expenses to retrieve
         start_date: Optional start date in YYYY-MM-DD format
         end_date: Optional end date in YYYY-MM-DD format
+        compact: Optional; if true, 'expenses' is columnar: 'columns' names the fields of each
+            entry in 'rows', the category field is an index into 'categories', and beyond 50
+            rows only the most recent are kept with the older ones summarized in 'omitted'
     
     Returns:
         Dictionary with 'ok' status, 'expenses' list, and summary information
@@ -67,6 +99,15 @@ def list_expenses(user_id: int, start_date: Optional[str] = None, end_date: Opti
             cat = exp['category']
             by_category[cat] = by_category.get(cat, 0) + exp['amount']
         
+        if compact:
+            return {
+                "ok": True,
+                "expenses": compact_expenses(expenses),
+                "total": round(total, 2),
+                "count": len(expenses),
+                "by_category": {k: round(v, 2) for k, v in by_category.items()},
+            }
+
         return {
             "ok": True,
             "expenses": expenses,
@@ -76,9 +117,11 @@ def list_expenses(user_id: int, start_date: Optional[str] = None, end_date: Opti
             "message": f"Found {len(expenses)} expense(s) totaling ${total:.2f}"
         }
     except Exception as e:
+        _raise_in_batch(e)
         return {"ok": False, "message": f"Error listing expenses: {str(e)}"}
     
 @mcp.tool()
+@instrument_tool
 def delete_expense(user_id: int, expense_id: int) -> Dict:
     """Delete an expense by ID.
     
@@ -93,10 +136,12 @@ def delete_expense(user_id: int, expense_id: int) -> Dict:
         result = db_delete(user_id, expense_id)
         return result
     except Exception as e:
+        _raise_in_batch(e)
         return {"ok": False, "message": f"Error deleting expense: {str(e)}"}
 
 
 @mcp.tool()
+@instrument_tool
 def edit_expense(
     user_id: int, 
     expense_id: int, 
@@ -125,17 +170,19 @@ def edit_expense(
         result = db_update(user_id, expense_id, amount, category, note, date)
         return result
     except Exception as e:
+        _raise_in_batch(e)
         return {"ok": False, "message": f"Error editing expense: {str(e)}"}
 
 
 @mcp.tool()
+@instrument_tool
 def get_expense_analysis(
     user_id: int, 
     start_date: Optional[str] = None, 
     end_date: Optional[str] = None,
-    group_by: Optional[str] = "category"
+    group_by: Optional[str] = "category",
+    compact: Optional[bool] = False
 ) -> Dict:
-    print("get_expense_analysis called with:", user_id, start_date, end_date, group_by)
     """Get detailed analytics and statistics for expenses.
     
     Args:
@@ -143,17 +190,194 @@ def get_expense_analysis(
         start_date: Optional start date in YYYY-MM-DD format
         end_date: Optional end date in YYYY-MM-DD format
         group_by: How to group the data - 'category', 'date', or 'month' (default: 'category')
+        compact: Optional; if true, grouped data is returned as 'groups' ([key, amount] pairs,
+            largest first, at most 50) with any remaining groups summarized in 'other'
     
     Returns:
         Dictionary with statistics including mean, median, total, min, max, and grouped data
     """
+    logger.debug("get_expense_analysis(%s, %s, %s, %s)", user_id, start_date, end_date, group_by)
     try:
         result = db_analytics(user_id, start_date, end_date, group_by)
-        return result
+        return compact_analysis(result) if compact else result
     except Exception as e:
+        _raise_in_batch(e)
         return {"ok": False, "message": f"Error generating analysis: {str(e)}"}
 
 
+class BatchOperation(BaseModel):
+    """One operation of an execute_batch call; fields are those of the matching tool."""
+    op: Literal["add", "edit", "delete", "list", "analyze"]
+    expense_id: Optional[int] = None
+    amount: Optional[float] = None
+    category: Optional[str] = None
+    note: Optional[str] = None
+    date: Optional[str] = None
+    start_date: Optional[str] = None
+    end_date: Optional[str] = None
+    group_by: Optional[str] = None
+    compact: Optional[bool] = None
+
+
+# Operations accepted by execute_batch, mapped to the tools above
+_BATCH_OPS = {
+    "add": add_expense,
+    "edit": edit_expense,
+    "delete": delete_expense,
+    "list": list_expenses,
+    "analyze": get_expense_analysis,
+}
+
+
+@mcp.tool()
+@instrument_tool
+def execute_batch(user_id: int, operations: List[BatchOperation]) -> Dict:
+    """Run several expense operations in a single call and database transaction.
+
+    Use this whenever one message asks for more than one operation, e.g.
+    "add 50 for uber, 200 for groceries and delete #5". Invalid operations
+    (unknown expense, non-positive amount) fail on their own; a database error
+    rolls back the whole batch.
+
+    Args:
+        user_id: The ID of the user; applies to every operation
+        operations: List of operations, run in order. Each has an 'op' ('add', 'edit',
+            'delete', 'list' or 'analyze') plus the arguments of that tool except user_id,
+            e.g. {"op": "add", "amount": 50, "category": "Transport", "note": "uber"}
+            or {"op": "delete", "expense_id": 5}
+
+    Returns:
+        Dictionary with 'ok' status (true if every operation succeeded), per-operation
+        'results' and a combined summary message
+    """
+    results = []
+    try:
+        with db_batch(user_id):
+            for operation in operations:
+                args = operation.model_dump(exclude_none=True)
+                op = args.pop("op")
+                try:
+                    result = _BATCH_OPS[op].fn(user_id=user_id, **args)
+                except TypeError as e:
+                    result = {"ok": False, "message": f"Invalid arguments for '{op}': {str(e)}"}
+                results.append({"op": op, **result})
+    except Exception as e:
+        return {"ok": False, "results": results, "message": f"Batch rolled back: {str(e)}"}
+
+    failed = sum(1 for result in results if not result["ok"])
+    # Compact list/analyze results carry no prose message
+    summary = "; ".join(
+        f"{result['op']}: {result.get('message', 'done' if result['ok'] else 'failed')}" for result in results
+    )
+    return {
+        "ok": failed == 0,
+        "results": results,
+        "message": f"{len(results) - failed}/{len(results)} operation(s) succeeded. {summary}"
+    }
+
+
+class ImportRow(BaseModel):
+    """One expense of an 'import' job."""
+    amount: float
+    category: str
+    note: Optional[str] = None
+    date: Optional[str] = None
+
+
+@mcp.tool()
+@instrument_tool
+def submit_job(
+    user_id: int,
+    kind: Literal["analysis", "export", "recategorize", "import"],
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    dry_run: Optional[bool] = None,
+    rows: Optional[List[ImportRow]] = None
+) -> Dict:
+    """Start a long-running operation in the background and return its job ID immediately.
+    
+    Args:
+        user_id: The ID of the user
+        kind: 'analysis' (full-history analytics by category and month), 'export' (CSV of
+            expenses, optionally between start_date and end_date), 'recategorize' (re-derive
+            every category from its note; dry_run=true only reports the changes) or
+            'import' (bulk insert of rows)
+        start_date: Optional start date in YYYY-MM-DD format (export only)
+        end_date: Optional end date in YYYY-MM-DD format (export only)
+        dry_run: Optional, recategorize only
+        rows: Expenses to insert (import only)
+    
+    Returns:
+        Dictionary with 'ok' status, 'job_id' and a message; poll job_status, then job_result
+    """
+    try:
+        if kind == "import" and not rows:
+            return {"ok": False, "message": "An import job needs rows."}
+        params = {
+            "start_date": start_date,
+            "end_date": end_date,
+            "dry_run": dry_run,
+            "rows": [row.model_dump() for row in rows] if rows else None,
+        }
+        return jobs.submit_job(user_id, kind, {k: v for k, v in params.items() if v is not None})
+    except Exception as e:
+        return {"ok": False, "message": f"Error submitting job: {str(e)}"}
+
+
+@mcp.tool()
+@instrument_tool
+def job_status(user_id: int, job_id: int) -> Dict:
+    """Get the status ('queued', 'running', 'done', 'failed' or 'cancelled') and progress (0-1) of a background job.
+    
+    Args:
+        user_id: The ID of the user who owns the job
+        job_id: The ID returned by submit_job
+    
+    Returns:
+        Dictionary with 'ok' status, 'status', 'progress', a message and timestamps
+    """
+    try:
+        return jobs.get_job(user_id, job_id)
+    except Exception as e:
+        return {"ok": False, "message": f"Error getting job status: {str(e)}"}
+
+
+@mcp.tool()
+@instrument_tool
+def job_result(user_id: int, job_id: int) -> Dict:
+    """Get the result of a finished background job.
+    
+    Args:
+        user_id: The ID of the user who owns the job
+        job_id: The ID returned by submit_job
+    
+    Returns:
+        Dictionary with 'ok' status and 'result' once the job is done, otherwise its status
+    """
+    try:
+        return jobs.get_job_result(user_id, job_id)
+    except Exception as e:
+        return {"ok": False, "message": f"Error getting job result: {str(e)}"}
+
+
+@mcp.tool()
+@instrument_tool
+def cancel_job(user_id: int, job_id: int) -> Dict:
+    """Cancel a queued or running background job.
+    
+    Args:
+        user_id: The ID of the user who owns the job
+        job_id: The ID returned by submit_job
+    
+    Returns:
+        Dictionary with 'ok' status and a message
+    """
+    try:
+        return jobs.cancel_job(user_id, job_id)
+    except Exception as e:
+        return {"ok": False, "message": f"Error cancelling job: {str(e)}"}
+
+
 
 if __name__ == "__main__":
     import sys
@@ -164,7 +388,10 @@ if __name__ == "__main__":
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
     
     print("Starting Expense Tracker MCP Server on http://0.0.0.0:8000")
+    print("Prometheus metrics on http://0.0.0.0:8000/metrics")
+    print(f"Starting {jobs.JOB_WORKERS} background job worker(s)")
     print("Press Ctrl+C to stop")
+    jobs.start_workers()
     
     try:
         mcp.run(transport="http", host="0.0.0.0", port=8000)
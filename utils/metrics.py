@@ -0,0 +1,200 @@
+# utils/metrics.py
+"""In-process metrics and sampled, non-blocking logging.
+
+Metrics are kept in memory and rendered in the Prometheus text format by
+render_prometheus(); main.py serves them on /metrics next to the MCP server.
+"""
+import functools
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from sub-millisecond SQL to slow tool calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_counters = {}    # name -> {labels: value}
+_histograms = {}  # name -> {labels: [bucket counts..., sum, count]}
+_help = {}
+
+
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def describe(name, help_text):
+    """Register the HELP text shown for a metric."""
+    _help[name] = help_text
+
+
+def inc(name, amount=1, **labels):
+    """Increment a counter."""
+    with _lock:
+        series = _counters.setdefault(name, {})
+        key = _key(labels)
+        series[key] = series.get(key, 0) + amount
+
+
+def observe(name, value, **labels):
+    """Record one observation in a histogram."""
+    with _lock:
+        series = _histograms.setdefault(name, {})
+        key = _key(labels)
+        state = series.get(key)
+        if state is None:
+            state = series[key] = [0] * (len(DEFAULT_BUCKETS) + 2)
+        for i, bound in enumerate(DEFAULT_BUCKETS):
+            if value <= bound:
+                state[i] += 1
+        state[-2] += value
+        state[-1] += 1
+
+
+@contextmanager
+def timed(name, **labels):
+    """Time the enclosed block into the histogram `name`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+class _QueryStats:
+    rows = 0
+
+
+@contextmanager
+def query_timer(query):
+    """Time a SQL query; set `.rows` on the yielded object to the rows it touched."""
+    stats = _QueryStats()
+    start = time.perf_counter()
+    try:
+        yield stats
+    finally:
+        observe("db_query_duration_seconds", time.perf_counter() - start, query=query)
+        inc("db_rows_total", stats.rows, query=query)
+
+
+def record_cache(cache, hit):
+    """Count a cache lookup as a hit or a miss."""
+    inc("cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+
+def instrument_tool(fn):
+    """Decorator recording latency and outcome of an MCP tool call."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            result = fn(*args, **kwargs)
+            if isinstance(result, dict) and not result.get("ok", True):
+                outcome = "failed"
+            else:
+                outcome = "ok"
+            return result
+        finally:
+            observe("mcp_tool_duration_seconds", time.perf_counter() - start, tool=fn.__name__)
+            inc("mcp_tool_calls_total", tool=fn.__name__, outcome=outcome)
+    return wrapper
+
+
+describe("mcp_tool_duration_seconds", "Latency of MCP tool calls.")
+describe("mcp_tool_calls_total", "MCP tool calls by outcome (ok, failed, error).")
+describe("db_query_duration_seconds", "Latency of SQL queries.")
+describe("db_rows_total", "Rows returned or modified by SQL queries.")
+describe("cache_requests_total", "Cache lookups by result (hit or miss).")
+describe("bcrypt_duration_seconds", "Time spent hashing or verifying passwords.")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def render_prometheus():
+    """Render all metrics in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        for name, series in sorted(_counters.items()):
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} counter")
+            for key, value in sorted(series.items()):
+                lines.append(f"{name}{_format_labels(key)} {value}")
+        for name, series in sorted(_histograms.items()):
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, state in sorted(series.items()):
+                for bound, count in zip(DEFAULT_BUCKETS, state):
+                    lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {state[-1]}")
+                lines.append(f"{name}_sum{_format_labels(key)} {state[-2]}")
+                lines.append(f"{name}_count{_format_labels(key)} {state[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    """Drop all recorded metrics (useful in benchmarks)."""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+# ------------------ Sampled logging ------------------
+
+class _SampleFilter(logging.Filter):
+    """Pass warnings and errors always, lower levels at `rate`."""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+_log_queue = queue.SimpleQueue()
+_listener = None
+
+
+def get_logger(name):
+    """Return a logger whose records are sampled and written off the request path.
+
+    Records are handed to a queue and written to stderr by a background
+    thread. EXPENSE_LOG_LEVEL (default INFO) and EXPENSE_LOG_SAMPLE_RATE
+    (default 0.1) control what gets through.
+    """
+    global _listener
+    logger = logging.getLogger(name)
+    if getattr(logger, "_sampled", False):
+        return logger
+
+    with _lock:
+        if _listener is None:
+            stream = logging.StreamHandler(sys.stderr)
+            stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+            _listener = logging.handlers.QueueListener(_log_queue, stream)
+            _listener.start()
+
+    handler = logging.handlers.QueueHandler(_log_queue)
+    handler.addFilter(_SampleFilter(float(os.getenv("EXPENSE_LOG_SAMPLE_RATE", "0.1"))))
+    logger.addHandler(handler)
+    logger.setLevel(os.getenv("EXPENSE_LOG_LEVEL", "INFO").upper())
+    logger.propagate = False
+    logger._sampled = True
+    return logger
@@ -0,0 +1,325 @@
+# utils/model_gateway.py
+"""Shared gateway for Gemini calls.
+
+Every model call made by the frontend and the voice helpers goes through a
+ModelGateway, which adds:
+
+- a token-bucket rate limiter and a cap on concurrent calls,
+- retries with jittered exponential backoff on 429/5xx and network errors,
+- hedging: if an attempt is slow, a second one is started and the first
+  to succeed wins,
+- a deadline for the whole call, retries included,
+- coalescing: identical calls already in flight share one result,
+- latency percentiles per label (latency_report()) and metrics.
+
+Retries and hedging can repeat a call, so they only apply to calls made
+with idempotent=True. Chat turns run their tool calls between model round
+trips (utils/tool_loop.py), so every round trip is idempotent.
+
+Set EXPENSE_FAKE_MODEL=1 to use FakeBackend instead of Gemini, e.g. for
+tests; `python -m utils.model_gateway` runs a simulated load against it and
+prints the latency report.
+"""
+import asyncio
+import collections
+import concurrent.futures
+import os
+import random
+import threading
+import time
+
+from utils.metrics import describe, inc, observe
+
+MODEL_RATE = float(os.getenv("EXPENSE_MODEL_RATE", "5"))        # calls per second
+MODEL_BURST = int(os.getenv("EXPENSE_MODEL_BURST", "10"))
+MODEL_CONCURRENCY = int(os.getenv("EXPENSE_MODEL_CONCURRENCY", "8"))
+MODEL_DEADLINE = float(os.getenv("EXPENSE_MODEL_DEADLINE", "60"))  # seconds, per call
+MODEL_HEDGE_AFTER = float(os.getenv("EXPENSE_MODEL_HEDGE_AFTER", "10"))
+MODEL_RETRIES = int(os.getenv("EXPENSE_MODEL_RETRIES", "3"))
+
+RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}
+
+describe("model_call_duration_seconds", "Latency of model calls through the gateway, retries included.")
+describe("model_call_events_total", "Model gateway events (attempt, retry, hedge, coalesced, failed, timeout).")
+
+
+class GatewayTimeout(TimeoutError):
+    """The call did not complete within its deadline."""
+
+
+def is_retryable(exc):
+    """True for rate limits, server errors, timeouts and network errors."""
+    if getattr(exc, "code", None) in RETRYABLE_CODES:
+        return True
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    # httpx transport errors and timeouts (used by google-genai) without importing httpx
+    return any(cls.__name__ in ("TransportError", "TimeoutException") for cls in type(exc).__mro__)
+
+
+class TokenBucket:
+    """Allows `rate` calls per second on average, with bursts of up to `burst`."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self):
+        """Take a token if one is available; otherwise return the seconds to wait."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    async def acquire(self):
+        while (wait := self._take()) > 0:
+            await asyncio.sleep(wait)
+
+
+class GeminiBackend:
+    """Calls the real Gemini API through a google-genai client."""
+
+    def __init__(self, client):
+        self.client = client
+
+    async def agenerate_content(self, **kwargs):
+        return await self.client.aio.models.generate_content(**kwargs)
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+        self.candidates = []
+        self.function_calls = None
+
+
+class FakeBackend:
+    """Local stand-in for Gemini.
+
+    Responds with responder(**kwargs) (default: echo the contents) after a
+    random latency drawn from `latency` (seconds, or a zero-argument
+    function). The exceptions in `failures` are raised, in order, by the
+    first calls.
+    """
+
+    def __init__(self, responder=None, latency=0.0, failures=()):
+        self.responder = responder or (lambda **kwargs: FakeResponse(f"echo: {kwargs.get('contents')}"))
+        self.latency = latency
+        self.failures = collections.deque(failures)
+        self.calls = 0
+
+    async def agenerate_content(self, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency() if callable(self.latency) else self.latency)
+        if self.failures:
+            raise self.failures.popleft()
+        return self.responder(**kwargs)
+
+
+class ModelGateway:
+    """Rate-limited, retrying, hedging, coalescing front for a model backend."""
+
+    def __init__(self, backend, rate=MODEL_RATE, burst=MODEL_BURST, concurrency=MODEL_CONCURRENCY,
+                 deadline=MODEL_DEADLINE, hedge_after=MODEL_HEDGE_AFTER, retries=MODEL_RETRIES,
+                 base_delay=0.5, max_delay=8.0):
+        self.backend = backend
+        self.bucket = TokenBucket(rate, burst)
+        self.deadline = deadline
+        self.hedge_after = hedge_after
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._inflight = {}  # coalescing key -> concurrent.futures.Future
+        self._inflight_lock = threading.Lock()
+        self._latencies = collections.defaultdict(lambda: collections.deque(maxlen=2000))
+
+    # ------------------ Public API ------------------
+
+    async def agenerate_content(self, *, idempotent=False, coalesce_key=None, deadline=None, label=None, **kwargs):
+        """Gateway version of client.aio.models.generate_content(**kwargs)."""
+        return await self.arun(
+            lambda: self.backend.agenerate_content(**kwargs),
+            idempotent=idempotent,
+            coalesce_key=coalesce_key,
+            deadline=deadline,
+            label=label or kwargs.get("model", "model"),
+        )
+
+    def generate_content(self, **kwargs):
+        """Blocking version of agenerate_content, for code outside an event loop."""
+        return asyncio.run(self.agenerate_content(**kwargs))
+
+    def call(self, fn, *, idempotent=False, coalesce_key=None, deadline=None, label="call"):
+        """Run a blocking function (e.g. a file upload) through the gateway."""
+        return asyncio.run(self.arun(lambda: asyncio.to_thread(fn), idempotent=idempotent,
+                                     coalesce_key=coalesce_key, deadline=deadline, label=label))
+
+    async def arun(self, attempt, *, idempotent=False, coalesce_key=None, deadline=None, label="call"):
+        """Run attempt() (returning an awaitable) with rate control, retries, hedging and a deadline.
+
+        Calls with the same coalesce_key that overlap share the first call's
+        outcome, even across threads and event loops.
+        """
+        if coalesce_key is None:
+            return await self._timed(attempt, idempotent, deadline, label)
+
+        with self._inflight_lock:
+            shared = self._inflight.get(coalesce_key)
+            leader = shared is None
+            if leader:
+                shared = self._inflight[coalesce_key] = concurrent.futures.Future()
+        if not leader:
+            inc("model_call_events_total", event="coalesced", label=label)
+            return await asyncio.wrap_future(shared)
+
+        try:
+            result = await self._timed(attempt, idempotent, deadline, label)
+        except BaseException as e:
+            shared.set_exception(e)
+            raise
+        else:
+            shared.set_result(result)
+            return result
+        finally:
+            with self._inflight_lock:
+                del self._inflight[coalesce_key]
+
+    def latency_report(self):
+        """Latency percentiles (seconds) of recent calls, per label."""
+        report = {}
+        for label, samples in self._latencies.items():
+            ordered = sorted(samples)
+            if not ordered:
+                continue
+            pick = lambda q: round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 4)
+            report[label] = {"count": len(ordered), "p50": pick(0.5), "p90": pick(0.9),
+                             "p99": pick(0.99), "max": round(ordered[-1], 4)}
+        return report
+
+    # ------------------ Internals ------------------
+
+    async def _timed(self, attempt, idempotent, deadline, label):
+        start = time.perf_counter()
+        try:
+            return await asyncio.wait_for(self._with_retries(attempt, idempotent, label),
+                                          deadline or self.deadline)
+        except asyncio.TimeoutError:
+            inc("model_call_events_total", event="timeout", label=label)
+            raise GatewayTimeout(f"Model call did not finish within {deadline or self.deadline:g}s") from None
+        finally:
+            elapsed = time.perf_counter() - start
+            self._latencies[label].append(elapsed)
+            observe("model_call_duration_seconds", elapsed, label=label)
+
+    async def _with_retries(self, attempt, idempotent, label):
+        retries = self.retries if idempotent else 0
+        for n in range(retries + 1):
+            try:
+                if idempotent and self.hedge_after:
+                    return await self._hedged(attempt, label)
+                return await self._attempt(attempt, label)
+            except Exception as e:
+                if n == retries or not is_retryable(e):
+                    inc("model_call_events_total", event="failed", label=label)
+                    raise
+                inc("model_call_events_total", event="retry", label=label)
+                # Full jitter: anywhere between 0 and the exponential backoff cap
+                await asyncio.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** n)))
+
+    async def _attempt(self, attempt, label):
+        await self.bucket.acquire()
+        while not self._slots.acquire(blocking=False):
+            await asyncio.sleep(0.01)
+        try:
+            inc("model_call_events_total", event="attempt", label=label)
+            return await attempt()
+        finally:
+            self._slots.release()
+
+    async def _hedged(self, attempt, label):
+        """Start a second attempt if the first is slower than hedge_after; first success wins."""
+        tasks = {asyncio.ensure_future(self._attempt(attempt, label))}
+        done, _ = await asyncio.wait(tasks, timeout=self.hedge_after)
+        if not done:
+            inc("model_call_events_total", event="hedge", label=label)
+            tasks.add(asyncio.ensure_future(self._attempt(attempt, label)))
+
+        error = None
+        try:
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def get_gateway():
+    """The process-wide gateway (Gemini, or FakeBackend when EXPENSE_FAKE_MODEL=1)."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            if os.getenv("EXPENSE_FAKE_MODEL") == "1":
+                backend = FakeBackend(latency=0.05)
+            else:
+                from dotenv import load_dotenv
+                from google import genai
+                load_dotenv()
+                backend = GeminiBackend(genai.Client(api_key=os.getenv("gemini_api_key")))
+            _default = ModelGateway(backend)
+    return _default
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    class RateLimited(Exception):
+        code = 429
+
+    parser = argparse.ArgumentParser(description="Simulate load on the gateway with a fake backend")
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--error-rate", type=float, default=0.1, help="share of attempts failing with 429")
+    args = parser.parse_args()
+
+    def latency():
+        # Mostly fast, with a slow tail that hedging should cut off
+        return random.uniform(0.3, 1.5) if random.random() < 0.05 else random.uniform(0.02, 0.08)
+
+    def responder(**kwargs):
+        if random.random() < args.error_rate:
+            raise RateLimited("429 RESOURCE_EXHAUSTED")
+        return FakeResponse("ok")
+
+    async def simulate(label, idempotent):
+        gateway = ModelGateway(FakeBackend(responder, latency), rate=1000, burst=50, concurrency=50,
+                               hedge_after=0.15, base_delay=0.05)
+        results = await asyncio.gather(
+            *[gateway.agenerate_content(model="fake", contents=str(i), idempotent=idempotent, label=label)
+              for i in range(args.calls)],
+            return_exceptions=True,
+        )
+        report = gateway.latency_report()[label]
+        report["errors"] = sum(isinstance(r, Exception) for r in results)
+        return report
+
+    print(json.dumps({
+        "send once": asyncio.run(simulate("send once", False)),
+        "retry + hedge": asyncio.run(simulate("retry + hedge", True)),
+    }, indent=2))
@@ -0,0 +1,191 @@
+# utils/query_cache.py
+"""Cache of resolved tool plans for paraphrased chat queries.
+
+"show my expenses this month" and "list this month's spending" lead the
+model to the same tool call. Prompts are normalized (synonyms folded,
+filler words dropped, relative dates resolved against today) into a key,
+and the read-only tool calls the model made for that key are remembered.
+A repeated intent can then replay the tool calls directly and skip the
+model. Only the plan is cached, never the data, so replays always return
+current numbers; a user's entries are still dropped whenever that user
+writes.
+"""
+import re
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+
+from utils.metrics import record_cache
+
+# Tools that only read and are safe to replay without the model
+READ_TOOLS = {"list_expenses", "get_expense_analysis"}
+
+SYNONYMS = {
+    "show": "list", "display": "list", "view": "list", "see": "list", "get": "list", "give": "list",
+    "expense": "expenses", "spending": "expenses", "spendings": "expenses", "transactions": "expenses",
+    "transaction": "expenses", "purchases": "expenses", "costs": "expenses",
+    "analyse": "analyze", "analysis": "analyze", "breakdown": "analyze", "stats": "analyze",
+    "statistics": "analyze", "summary": "analyze", "summarize": "analyze", "trends": "analyze",
+    "trend": "analyze", "monthly": "month", "months": "month", "daily": "date", "day": "date",
+    "categories": "category", "average": "mean", "avg": "mean",
+}
+
+# Canonical words a cacheable prompt may consist of. Anything else is either
+# a write ("add", "delete") or something the model works out from the tool
+# output itself ("food", "largest"), which replaying the plan cannot reproduce.
+INTENT_WORDS = {"list", "expenses", "analyze", "month", "date", "category", "mean", "total", "grouped"}
+
+STOPWORDS = {
+    "a", "an", "the", "my", "me", "i", "of", "for", "please", "can", "could", "you", "what", "whats",
+    "is", "are", "was", "were", "do", "did", "have", "has", "in", "on", "to", "from", "all", "every",
+    "much", "how", "and", "with", "by", "up", "it", "s", "far", "so",
+}
+
+
+def _month_start(day):
+    return day.replace(day=1)
+
+
+def _date_phrases(today):
+    """Relative date phrases mapped to the absolute range they mean."""
+    week_start = today - timedelta(days=today.weekday())
+    last_month_end = _month_start(today) - timedelta(days=1)
+    return [
+        ("this month", _month_start(today), today),
+        ("last month", _month_start(last_month_end), last_month_end),
+        ("this week", week_start, today),
+        ("last week", week_start - timedelta(days=7), week_start - timedelta(days=1)),
+        ("this year", today.replace(month=1, day=1), today),
+        ("last year", today.replace(year=today.year - 1, month=1, day=1),
+         today.replace(year=today.year - 1, month=12, day=31)),
+        ("yesterday", today - timedelta(days=1), today - timedelta(days=1)),
+        ("today", today, today),
+    ]
+
+
+def normalize_prompt(prompt, today):
+    """Return the canonical form of a prompt, or None if it must go to the model.
+
+    Only prompts made of INTENT_WORDS and relative dates are cacheable.
+
+    today is the YYYY-MM-DD string the model is given as today's date.
+    """
+    today = date.fromisoformat(today)
+    text = prompt.lower().replace("'s", "").replace("’s", "")
+
+    # Resolve relative dates to absolute ranges
+    ranges = []
+    match = re.search(r"\b(?:last|past) (\d+) days?\b", text)
+    if match:
+        ranges.append(f"{today - timedelta(days=int(match.group(1)))}:{today}")
+        text = text.replace(match.group(0), " ")
+    for phrase, start, end in _date_phrases(today):
+        if re.search(rf"\b{phrase}\b", text):
+            ranges.append(f"{start}:{end}")
+            text = re.sub(rf"\b{phrase}\b", " ", text)
+
+    words = re.findall(r"[a-z0-9#\-]+", text)
+    tokens = {SYNONYMS.get(word, word) for word in words} - STOPWORDS
+    if not tokens <= INTENT_WORDS:
+        return None
+    if "analyze" in tokens:
+        # "show me an analysis" and "analyze" are the same request
+        tokens.discard("list")
+    tokens.update(f"range:{r}" for r in ranges)
+    return " ".join(sorted(tokens)) or None
+
+
+def extract_tool_plan(history):
+    """Return the [(tool name, args)] calls made in a chat turn's history (Gemini Contents)."""
+    plan = []
+    for content in history:
+        for part in getattr(content, "parts", None) or []:
+            call = getattr(part, "function_call", None)
+            if call and call.name:
+                plan.append((call.name, dict(call.args or {})))
+    return plan
+
+
+class QueryCache:
+    """Maps (user, day, normalized prompt) to a read-only tool plan."""
+
+    def __init__(self, ttl=900, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (stored at, plan)
+
+    def key(self, user_id, prompt, today):
+        """Cache key for a prompt, or None if the prompt must always go to the model."""
+        normalized = normalize_prompt(prompt, today)
+        return (user_id, today, normalized) if normalized else None
+
+    def get(self, key):
+        """Return the cached plan for key, or None."""
+        entry = self._entries.get(key) if key else None
+        if entry and time.monotonic() - entry[0] > self.ttl:
+            del self._entries[key]
+            entry = None
+        record_cache("query_plan", entry is not None)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def record(self, key, user_id, plan):
+        """Remember the plan the model chose, or invalidate the user's entries if it wrote."""
+        if any(name not in READ_TOOLS for name, _ in plan):
+            self.invalidate_user(user_id)
+            return
+        if not key or not plan:
+            return
+        self._entries[key] = (time.monotonic(), plan)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id):
+        """Drop every cached plan of a user."""
+        for key in [k for k in self._entries if k[0] == user_id]:
+            del self._entries[key]
+
+
+def _expense_rows(expenses):
+    """Rows of (id, amount, category, note, date) from full or compact list output."""
+    if isinstance(expenses, dict):
+        categories = expenses["categories"]
+        return [(i, amount, categories[cat], note, day) for i, amount, cat, note, day in expenses["rows"]]
+    return [(e["id"], e["amount"], e["category"], e["note"], e["date"]) for e in expenses]
+
+
+def render_tool_result(name, result):
+    """Format a replayed tool result as Markdown for the chat."""
+    if not result.get("ok"):
+        return f"⚠️ {result.get('message', 'Request failed.')}"
+
+    if name == "list_expenses":
+        rows = _expense_rows(result["expenses"])
+        if not rows:
+            return "No expenses found for that period."
+        lines = ["| ID | Amount | Category | Note | Date |", "|---|---|---|---|---|"]
+        lines += [f"| {i} | ${amount:.2f} | {category} | {note or ''} | {day} |"
+                  for i, amount, category, note, day in rows]
+        omitted = result["expenses"].get("omitted") if isinstance(result["expenses"], dict) else None
+        if omitted:
+            lines.append(f"\n…plus {omitted['count']} older expense(s) totaling ${omitted['total']:.2f}.")
+        lines.append(f"\n**Total:** ${result['total']:.2f} across {result['count']} expense(s)")
+        return "\n".join(lines)
+
+    if name == "get_expense_analysis":
+        if not result.get("count"):
+            return result.get("message", "No expenses found for the given period.")
+        groups = result.get("groups") or list(result.get("grouped_data", {}).items())
+        lines = [
+            f"**{result['count']} expenses, ${result['total']:.2f} total**",
+            f"- Average: ${result['mean']:.2f} (median ${result['median']:.2f}, std dev ${result['std_dev']:.2f})",
+            f"- Smallest: ${result['min']:.2f}, largest: ${result['max']:.2f}",
+            f"\n**By {result['grouped_by']}:**",
+        ]
+        lines += [f"- {key}: ${amount:.2f}" for key, amount in groups]
+        return "\n".join(lines)
+
+    return result.get("message", "Done.")
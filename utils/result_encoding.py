@@ -0,0 +1,72 @@
+# utils/result_encoding.py
+"""Compact, token-efficient encodings of tool results.
+
+Tool results are serialized into the model context, so repeated dict keys
+and long lists cost tokens and latency. The compact forms here are columnar
+(one header, then rows), dictionary-encode categories, and above a size
+threshold keep only part of the data plus summary statistics of the rest.
+"""
+
+# Rows / groups kept before the remainder is summarized
+COMPACT_MAX_ROWS = 50
+
+EXPENSE_COLUMNS = ["id", "amount", "category", "note", "date"]
+
+
+def _summary(amounts):
+    return {
+        "count": len(amounts),
+        "total": round(sum(amounts), 2),
+        "min": round(min(amounts), 2),
+        "max": round(max(amounts), 2),
+        "mean": round(sum(amounts) / len(amounts), 2),
+    }
+
+
+def compact_expenses(expenses, max_rows=COMPACT_MAX_ROWS):
+    """Encode list_expenses rows (dicts, oldest first) as columns + rows.
+
+    The category column holds an index into "categories". When there are more
+    than max_rows expenses only the most recent max_rows are kept and the
+    older ones are described in "omitted".
+    """
+    kept = expenses[-max_rows:] if max_rows else expenses
+    categories = []
+    index = {}
+    rows = []
+    for exp in kept:
+        category = exp["category"]
+        if category not in index:
+            index[category] = len(categories)
+            categories.append(category)
+        rows.append([exp["id"], exp["amount"], index[category], exp["note"], exp["date"]])
+
+    encoded = {"columns": EXPENSE_COLUMNS, "categories": categories, "rows": rows}
+    omitted = expenses[:len(expenses) - len(kept)]
+    if omitted:
+        encoded["omitted"] = {
+            **_summary([exp["amount"] for exp in omitted]),
+            "from": omitted[0]["date"],
+            "to": omitted[-1]["date"],
+        }
+    return encoded
+
+
+def compact_analysis(analysis, max_groups=COMPACT_MAX_ROWS):
+    """Encode a get_expense_analytics result compactly.
+
+    grouped_data (already sorted by amount, largest first) becomes
+    [key, amount] pairs truncated to max_groups, with the rest summarized in
+    "other". The prose message and top_spending (the first group) are dropped
+    since they repeat the statistics.
+    """
+    if not analysis.get("ok") or "grouped_data" not in analysis:
+        return analysis
+
+    encoded = {k: v for k, v in analysis.items() if k not in ("grouped_data", "top_spending", "message")}
+    groups = [[key, amount] for key, amount in analysis["grouped_data"].items()]
+    encoded["groups"] = groups[:max_groups]
+    rest = groups[max_groups:]
+    if rest:
+        encoded["other"] = _summary([amount for _, amount in rest])
+    return encoded
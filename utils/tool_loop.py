@@ -0,0 +1,55 @@
+# utils/tool_loop.py
+"""Function-calling loop for chat turns, driven outside the model SDK.
+
+With automatic function calling the SDK runs tool calls (including writes
+such as add_expense) inside a single generate_content call, so the call
+cannot be retried without repeating them. Here each model round trip is a
+separate gateway call with idempotent=True, safe to retry and hedge since it
+only reads the conversation so far, and each tool call the model asks for
+runs exactly once between round trips.
+"""
+from google.genai import types
+
+# Model round trips per turn before giving up on a final answer
+MAX_TOOL_ROUNDS = 10
+
+
+def gemini_tools(mcp_tools):
+    """Gemini tool declarations for the tools listed by an MCP server."""
+    return [types.Tool(function_declarations=[
+        types.FunctionDeclaration(name=tool.name, description=tool.description,
+                                  parameters_json_schema=tool.inputSchema)
+        for tool in mcp_tools
+    ])]
+
+
+async def run_tool_loop(gateway, call_tool, prompt, *, model, config, coalesce_key=None, label="chat",
+                        max_rounds=MAX_TOOL_ROUNDS):
+    """Answer prompt, running the tools the model asks for; return (final response, history).
+
+    call_tool(name, args) is awaited once per function call and returns the
+    dict sent back to the model. config should declare the tools and disable
+    automatic function calling. coalesce_key only applies to the first round
+    trip, the one that depends on the prompt alone.
+    """
+    history = [types.Content(role="user", parts=[types.Part.from_text(text=prompt)])]
+    response = None
+    for round_trip in range(max_rounds):
+        response = await gateway.agenerate_content(
+            idempotent=True,
+            coalesce_key=coalesce_key if round_trip == 0 else None,
+            label=label,
+            model=model,
+            contents=list(history),
+            config=config,
+        )
+        calls = response.function_calls
+        if not calls:
+            break
+        history.append(response.candidates[0].content)
+        results = []
+        for call in calls:
+            result = await call_tool(call.name, dict(call.args or {}))
+            results.append(types.Part.from_function_response(name=call.name, response=result))
+        history.append(types.Content(role="user", parts=results))
+    return response, history
@@ -3,12 +3,16 @@ from google.genai import types
 import wave
 from dotenv import load_dotenv
 import os
+from utils.model_gateway import get_gateway
 
 load_dotenv()  # Load environment variables from .env file
 
 gemini_api_key = os.getenv("gemini_api_key")
 
 client = genai.Client(api_key=gemini_api_key)
+# Transcription and speech calls only read, so the gateway may retry and hedge them.
+# Each upload creates a new file, so uploads are sent once.
+gateway = get_gateway()
 # myfile = client.files.upload(file=audio_file)
 prompt = 'Generate a transcript of the speech. written in engligh wording not in hindi language'
 
@@ -17,10 +21,11 @@ prompt = 'Generate a transcript of the speech. written in engligh wording not in
 # print(stt_response.text)
 
 def speech_to_text(audio_file):
-    myfile = client.files.upload(file=audio_file)
-    stt_response = client.models.generate_content(
+    myfile = gateway.call(lambda: client.files.upload(file=audio_file), label="upload")
+    stt_response = gateway.generate_content(
     model='gemini-2.5-flash',
-    contents=[prompt, myfile]
+    contents=[prompt, myfile],
+    idempotent=True, label="stt"
     )
     return stt_response.text
 
@@ -36,12 +41,13 @@ def speech_to_text2(uploaded_file):
             f.write(uploaded_file.read())
 
         # Upload to Gemini Files
-        myfile = client.files.upload(temp_path)
+        myfile = gateway.call(lambda: client.files.upload(file=temp_path), label="upload")
 
         # Perform transcription
-        stt_response = client.models.generate_content(
+        stt_response = gateway.generate_content(
             model="gemini-2.5-flash",
-            contents=["Transcribe this audio into text:", myfile]
+            contents=["Transcribe this audio into text:", myfile],
+            idempotent=True, label="stt"
         )
 
         # Clean up temp file
@@ -85,7 +91,8 @@ def wave_file(filename, pcm, channels=1, rate=24000, sample_width=2):
 # wave_file(file_name, data) # Saves the file to current directory
 
 def text_to_speech(text, output_path="outputs/tts_output.wav"):
-    response = client.models.generate_content(
+    response = gateway.generate_content(
+       idempotent=True, label="tts",
        model="gemini-2.5-flash-preview-tts",
        contents=text,
        config=types.GenerateContentConfig(
@@ -106,8 +113,9 @@ def text_to_speech(text, output_path="outputs/tts_output.wav"):
     return output_path
 
 def llm(prompt):
-    response = client.models.generate_content(
+    response = gateway.generate_content(
     model='gemini-2.5-flash',
-    contents=[prompt]
+    contents=[prompt],
+    idempotent=True, label="llm"
     )
     return response.text
\ No newline at end of file